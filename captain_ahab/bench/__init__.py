@@ -0,0 +1,6 @@
+from .runner import BENCHMARKS, benchmark, measure, measure_async, run_benchmarks, compare
+# Importing the suites registers their benchmarks
+from . import capture, vision, scheduling, timing, startup
+
+
+__all__ = ['BENCHMARKS', 'benchmark', 'measure', 'measure_async', 'run_benchmarks', 'compare']
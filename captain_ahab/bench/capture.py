@@ -0,0 +1,87 @@
+import contextlib
+import logging
+import os
+import shutil
+import subprocess
+import numpy
+from ..utils.settings import get_settings
+from ..core.capture import XShmSource, get_capture_source
+from .runner import benchmark, measure
+
+
+logger = logging.getLogger(__name__)
+
+# The live screen sources, each skipped when it cannot capture here (no display, not X11, ...)
+SCREEN_SOURCES = ('imagegrab', 'xshm')
+
+
+@contextlib.contextmanager
+def xvfb_display(width, height):
+    """ Run a private Xvfb server of the given screen size for the duration of the block, yielding its display name """
+    read_fd, write_fd = os.pipe()
+    # -retro paints the root window with the classic stipple rather than black, so frames have content to check
+    process = subprocess.Popen(
+        ['Xvfb', '-displayfd', str(write_fd), '-screen', '0', f'{width}x{height}x24', '-nolisten', 'tcp', '-retro'],
+        pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    os.close(write_fd)
+    try:
+        # Xvfb writes the display number it picked once it accepts connections, or exits and closes the pipe
+        with os.fdopen(read_fd) as stream:
+            number = stream.readline().strip()
+        if not number:
+            raise OSError(f'Xvfb exited with {process.wait()} before accepting connections')
+        yield f':{number}'
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def measure_source(source, field, duration) -> dict:
+    buffer = numpy.empty(source.frame_shape(field), dtype=numpy.uint8)
+    return measure(lambda: source.grab_into(field, buffer), duration=duration)
+
+
+@benchmark('capture')
+def screen_capture(duration, frames=None):
+    """
+    Frames per second and latency of each live capture source, grabbing the configured sample_dimensions
+
+    When Xvfb is installed, the xshm source is also run against a private Xvfb server (the `xshm xvfb` case), which
+    works without any display.  Its first frame must show the server's stipple background, so a capture which
+    silently returns nothing fails the benchmark instead of reporting a rate.
+    """
+    sample = get_settings().sample
+    dimensions = f'{sample.width}x{sample.height}'
+    results = []
+    for name in SCREEN_SOURCES:
+        try:
+            source = get_capture_source(name)
+        except (OSError, ValueError) as error:
+            logger.warning(f'Skipping the {name} capture source: {error}')
+            continue
+
+        try:
+            results.append({'case': name, 'field': dimensions, **measure_source(source, sample.field, duration)})
+        except (OSError, ValueError) as error:
+            logger.warning(f'Skipping the {name} capture source: {error}')
+        finally:
+            source.close()
+
+    if shutil.which('Xvfb') is None:
+        logger.warning('Skipping the xshm xvfb case: Xvfb is not installed')
+        return results
+
+    with xvfb_display(sample.right, sample.bottom) as display:
+        source = XShmSource(display=display)
+        try:
+            if not source.grab(sample.field).any():
+                raise ValueError(f'The xshm source captured an empty frame from Xvfb {display}')
+            results.append({'case': 'xshm xvfb', 'field': dimensions, **measure_source(source, sample.field, duration)})
+        finally:
+            source.close()
+
+    return results
+
+
+__all__ = []
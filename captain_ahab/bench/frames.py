@@ -0,0 +1,57 @@
+import logging
+import numpy
+from cv2 import cv2 as cv
+from ..core.capture import CaptureSource
+
+
+logger = logging.getLogger(__name__)
+
+
+class SyntheticSource(CaptureSource):
+    """
+    Generates frames of blurred noise covering a screen bbox, standing in for the desktop in benchmarks
+
+    The background stays within dull mid-tones so it matches neither the learned trigger colors nor the templates,
+    meaning every detector runs to completion on every look.  A few `variants` are generated up front and cycled
+    through so change detection never considers two consecutive frames identical.
+    """
+
+    def __init__(self, field, variants=4, seed=0):
+        left, top, right, bottom = field
+        self.field = field
+        random = numpy.random.default_rng(seed)
+
+        self._frames = []
+        for _ in range(variants):
+            noise = random.integers(40, 100, size=(bottom - top, right - left, 3), dtype=numpy.uint8)
+            self._frames.append(cv.GaussianBlur(noise, (5, 5), 0))
+        self._index = 0
+
+    def grab(self, bbox):
+        frame = self._frames[self._index]
+        self._index = (self._index + 1) % len(self._frames)
+
+        left, top, right, bottom = bbox
+        x, y = self.field[:2]
+        return frame[top - y:bottom - y, left - x:right - x]
+
+    def stamp(self, image, position):
+        """ Paste an RGB image into every variant at the given position relative to the field """
+        x, y = position
+        height, width = image.shape[:2]
+        for frame in self._frames:
+            frame[y:y + height, x:x + width] = image
+
+
+def random_templates(count, size=48, seed=1):
+    """ Distinct noise templates, none of which appear in a SyntheticSource frame """
+    random = numpy.random.default_rng(seed)
+    return [random.integers(0, 256, size=(size, size, 3), dtype=numpy.uint8) for _ in range(count)]
+
+
+def trigger_colors(count):
+    """ Saturated colors well away from each other and from the SyntheticSource background """
+    return [(250, (index * 32) % 256, 255 - (index * 32) % 256) for index in range(count)]
+
+
+__all__ = ['SyntheticSource', 'random_templates', 'trigger_colors']
@@ -0,0 +1,135 @@
+import logging
+import platform
+import subprocess
+import time
+import numpy
+from cv2 import cv2 as cv
+from .. import __version__
+from ..utils.instruments import LatencyHistogram
+
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {}
+
+# The fields which identify a result when comparing reports, the rest are measurements
+RESULT_PARAMETERS = ('benchmark', 'case', 'field', 'detectors', 'batch')
+
+
+def benchmark(name):
+    """ Register a benchmark: a function taking (duration, frames) and returning a list of result records """
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def measure(func, duration=1.0, operations=1, warmup=3, min_iterations=5) -> dict:
+    """
+    Call `func` repeatedly for at least `duration` seconds and summarize the latency of each call
+
+    `operations` is the number of operations one call performs, so batched benchmarks report a per-operation rate.
+    """
+    for _ in range(warmup):
+        func()
+
+    histogram = LatencyHistogram()
+    started = time.perf_counter()
+    while True:
+        tick = time.perf_counter()
+        func()
+        now = time.perf_counter()
+        histogram.record(now - tick)
+
+        if histogram.total >= min_iterations and now - started >= duration:
+            break
+
+    return summarize(histogram, time.perf_counter() - started, operations)
+
+
+async def measure_async(func, duration=1.0, operations=1, warmup=3, min_iterations=5) -> dict:
+    """ measure() for a coroutine function, awaited on the running loop """
+    for _ in range(warmup):
+        await func()
+
+    histogram = LatencyHistogram()
+    started = time.perf_counter()
+    while True:
+        tick = time.perf_counter()
+        await func()
+        now = time.perf_counter()
+        histogram.record(now - tick)
+
+        if histogram.total >= min_iterations and now - started >= duration:
+            break
+
+    return summarize(histogram, time.perf_counter() - started, operations)
+
+
+def summarize(histogram, elapsed, operations=1) -> dict:
+    result = histogram.summary()
+    result['elapsed'] = elapsed
+    result['per_second'] = histogram.total * operations / elapsed if elapsed else 0.0
+    return result
+
+
+def git_commit():
+    """ The commit being benchmarked, when run from a git checkout """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(names=None, duration=1.0, frames=None) -> dict:
+    """ Run the named benchmarks (all by default) and return a JSON-serializable report """
+    names = names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Unknown benchmark: {name}')
+
+    report = {
+        'version': __version__,
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': numpy.__version__,
+        'opencv': cv.__version__,
+        'duration': duration,
+        'results': []
+    }
+
+    for name in names:
+        logger.info(f'Running the {name} benchmark')
+        for record in BENCHMARKS[name](duration=duration, frames=frames):
+            report['results'].append({'benchmark': name, **record})
+
+    return report
+
+
+def result_key(record) -> tuple:
+    """ Identifies a result across reports, ignoring the measurements """
+    return tuple((key, str(record[key])) for key in RESULT_PARAMETERS if key in record)
+
+
+def compare(baseline, report):
+    """ Yield (case, baseline rate, current rate, ratio) for each result present in both reports """
+    previous = {result_key(record): record for record in baseline['results']}
+    for record in report['results']:
+        key = result_key(record)
+        if key in previous:
+            before, after = previous[key]['per_second'], record['per_second']
+            yield (
+                ' '.join(f'{value}' for _, value in key),
+                before,
+                after,
+                after / before if before else 0.0
+            )
+
+
+__all__ = ['BENCHMARKS', 'benchmark', 'measure', 'measure_async', 'run_benchmarks', 'compare']
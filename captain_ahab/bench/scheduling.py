@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import random
+from queue import Empty
+from ..core import CaptainAhab
+from ..core.actions import Wait
+from ..core.inputs import RecordingBackend
+from ..core.scheduler import ActionScheduler
+from ..core.timepieces import TimerQueue
+from ..core.trainers import SightTrainer
+from .runner import benchmark, measure, measure_async
+from .vision import synthetic_eyes
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+LOOP_FIELD = (1280, 720)
+
+
+@benchmark('scheduler')
+def scheduler_throughput(duration, frames=None):
+    """
+    PrioritizedAction throughput through the ActionScheduler, in batches of queued then drained actions
+
+    The batches repeat one action, so they are queued without merging except in the `merged` case, which measures
+    requests collapsing into the few already pending.
+    """
+    scheduler = ActionScheduler()
+    action = Wait(captain=None)
+    priorities = [random.randint(1, 4) for _ in range(BATCH_SIZE)]
+
+    def put_get(merge=False):
+        for priority in priorities:
+            scheduler.put(action, priority, merge=merge)
+        while scheduler:
+            scheduler.recycle(scheduler.get_nowait())
+
+    async def put_get_async():
+        for priority in priorities:
+            scheduler.put(action, priority, merge=False)
+        while scheduler:
+            scheduler.recycle(await scheduler.get(timeout=0))
+
+    loop = asyncio.new_event_loop()
+    try:
+        return [
+            {'case': 'get_nowait', 'batch': BATCH_SIZE,
+             **measure(put_get, duration=duration, operations=BATCH_SIZE)},
+            {'case': 'get', 'batch': BATCH_SIZE,
+             **loop.run_until_complete(measure_async(put_get_async, duration=duration, operations=BATCH_SIZE))},
+            {'case': 'merged', 'batch': BATCH_SIZE,
+             **measure(lambda: put_get(merge=True), duration=duration, operations=BATCH_SIZE)}
+        ]
+    finally:
+        loop.close()
+
+
+@benchmark('timers')
+def timer_throughput(duration, frames=None):
+    """ TimerQueue throughput scheduling then firing batches of timers, and the cost of a check with none due """
+    timers = TimerQueue()
+    names = [f'timer_{index}' for index in range(BATCH_SIZE)]
+    delays = [random.uniform(-1.0, 0.0) for _ in range(BATCH_SIZE)]
+
+    def schedule_fire():
+        for name, delay in zip(names, delays):
+            timers.schedule(name, delay, callback=int)
+        timers.fire()
+
+    pending = TimerQueue()
+    for name in names:
+        pending.schedule(name, 3600)
+
+    return [
+        {'case': 'schedule_fire', 'batch': BATCH_SIZE,
+         **measure(schedule_fire, duration=duration, operations=BATCH_SIZE)},
+        {'case': 'none_due', 'batch': BATCH_SIZE, **measure(pending.fire, duration=duration)}
+    ]
+
+
+@benchmark('loop')
+def loop_ticks(duration, frames=None):
+    """
+    Ticks per second of the look/act loop, without the random pause between ticks
+
+    Input goes to a RecordingBackend and the frames never contain anything to react to, so each tick updates the
+    cortex, queues a Look and performs it without any of the timed fishing actions.
+    """
+    captain = CaptainAhab(0, 0, *LOOP_FIELD, inputs=RecordingBackend())
+    captain.eyes = SightTrainer.teach(synthetic_eyes(*LOOP_FIELD))
+
+    async def tick():
+        await captain.update()
+        captain.look()
+
+        try:
+            while captain.alive:
+                await captain.perform_next_action(timeout=0)
+        except Empty:
+            pass
+
+    loop = asyncio.new_event_loop()
+    try:
+        return [{'field': 'x'.join(map(str, LOOP_FIELD)), **loop.run_until_complete(measure_async(tick, duration))}]
+    finally:
+        loop.close()
+        captain.kill()
+
+
+__all__ = []
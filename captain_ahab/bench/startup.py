@@ -0,0 +1,60 @@
+import logging
+import subprocess
+import sys
+from .runner import benchmark, measure
+
+
+logger = logging.getLogger(__name__)
+
+# Run as `python -c`, so the timings include interpreter startup as the console script would
+CLI_SCRIPT = 'import sys; from captain_ahab.cli import cli; cli(sys.argv[1:], prog_name="captain-ahab")'
+CLI_COMMANDS = (('--help',), ('config',))
+IMPORTED_MODULES = ('captain_ahab.cli', 'captain_ahab.utils.settings', 'captain_ahab.core')
+SLOWEST_IMPORTS = 10
+
+
+def import_times(module) -> list:
+    """ (module, self seconds, cumulative seconds) for each module loaded by importing `module`, from -X importtime """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True
+    )
+
+    timings = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        own, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return timings
+
+
+@benchmark('startup')
+def startup(duration, frames=None):
+    """ Wall time of quick CLI commands and of importing the main modules, with the slowest imports of each """
+    results = []
+    for arguments in CLI_COMMANDS:
+        command = [sys.executable, '-c', CLI_SCRIPT, *arguments]
+        results.append({
+            'case': f'captain-ahab {" ".join(arguments)}',
+            **measure(lambda: subprocess.run(command, stdout=subprocess.DEVNULL, check=True), duration=duration,
+                      warmup=1)
+        })
+
+    for module in IMPORTED_MODULES:
+        command = [sys.executable, '-c', f'import {module}']
+        timings = import_times(module)
+        results.append({
+            'case': f'import {module}',
+            'modules': len(timings),
+            'slowest_imports': [
+                {'module': name, 'self': own, 'cumulative': cumulative}
+                for name, own, cumulative in sorted(timings, key=lambda timing: timing[1], reverse=True)
+            ][:SLOWEST_IMPORTS],
+            **measure(lambda: subprocess.run(command, check=True), duration=duration, warmup=1)
+        })
+
+    return results
+
+
+__all__ = ['import_times']
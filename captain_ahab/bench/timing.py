@@ -0,0 +1,93 @@
+import contextlib
+import logging
+import threading
+import time
+from ..core.inputs import RecordingBackend
+from ..core.timepieces import PrecisionTimer
+from ..core.trainers import SightTrainer
+from ..utils.instruments import LatencyHistogram
+from .runner import benchmark, summarize
+from .vision import synthetic_eyes
+
+
+logger = logging.getLogger(__name__)
+
+# Requested key holds, in seconds, from a tap to a hook click
+HOLD_DURATIONS = (0.005, 0.02, 0.1)
+LOAD_FIELD = (1280, 720)
+
+
+def sleep_hold(press, release, duration):
+    """ The hold actions used before the PrecisionTimer: press, time.sleep, release """
+    press()
+    pressed = time.perf_counter()
+    time.sleep(duration)
+    release()
+    return time.perf_counter() - pressed
+
+
+class LookLoad:
+    """ Runs Eyes.look in a thread, loading the process as the captain's vision does while it holds keys """
+
+    def __init__(self):
+        self.eyes = SightTrainer.teach(synthetic_eyes(*LOAD_FIELD))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='timing-load', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.eyes.look()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.eyes.close()
+        return False
+
+
+@benchmark('timing')
+def hold_accuracy(duration, frames=None):
+    """
+    Error between requested and actual key hold durations, with time.sleep and with the PrecisionTimer
+
+    Each hold is recorded as |actual - requested| seconds, so the latency columns of the report are the timing error
+    and `per_second` the holds made.  The `looking` cases hold keys while another thread runs Eyes.look.
+    """
+    inputs = RecordingBackend()
+    timer = PrecisionTimer()
+    strategies = {
+        'sleep': sleep_hold,
+        'precise': timer.hold
+    }
+
+    def press():
+        inputs.press_key(0x45)
+
+    def release():
+        inputs.release_key(0x45)
+
+    results = []
+    for load in ('idle', 'looking'):
+        with LookLoad() if load == 'looking' else contextlib.nullcontext():
+            for held in HOLD_DURATIONS:
+                for name, hold in strategies.items():
+                    histogram = LatencyHistogram()
+                    early = 0
+                    started = time.perf_counter()
+                    while histogram.total < 5 or time.perf_counter() - started < duration:
+                        actual = hold(press, release, held)
+                        early += actual < held
+                        histogram.record(abs(actual - held))
+                        inputs.clear()
+
+                    results.append({'case': f'{name} {held * 1000:g}ms {load}', 'early': early,
+                                    **summarize(histogram, time.perf_counter() - started)})
+
+    return results
+
+
+__all__ = []
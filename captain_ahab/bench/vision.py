@@ -0,0 +1,128 @@
+import logging
+import pathlib
+import tempfile
+from cv2 import cv2 as cv
+from ..utils.settings import get_settings
+from ..core.angler import Angler, FishingState
+from ..core.capture import FramePool, ReplaySource
+from ..core.sight import Eyes
+from ..core.templates import TemplateCache
+from ..core.trainers import SightTrainer
+from .frames import SyntheticSource, random_templates, trigger_colors
+from .runner import benchmark, measure
+
+
+logger = logging.getLogger(__name__)
+
+FIELD_SIZES = ((640, 360), (1280, 720), (1920, 1080))
+DETECTOR_COUNTS = (1, 2, 4, 8)
+SCALING_FIELD = (1280, 720)
+
+
+def synthetic_eyes(width, height, workers=0) -> Eyes:
+    """ Untrained Eyes over a synthetic field, with change detection off so every look runs the detectors """
+    field = (0, 0, width, height)
+    return Eyes(*field, source=SyntheticSource(field), pool=FramePool(), change_threshold=0, workers=workers)
+
+
+@benchmark('look')
+def look_field_sizes(duration, frames=None):
+    """ Eyes.look with the shipped images and triggers at several field sizes """
+    results = []
+    for width, height in FIELD_SIZES:
+        eyes = SightTrainer.teach(synthetic_eyes(width, height))
+        try:
+            results.append({'field': f'{width}x{height}', **measure(eyes.look, duration=duration)})
+        finally:
+            eyes.close()
+    return results
+
+
+@benchmark('states')
+def look_fishing_states(duration, frames=None):
+    """ Eyes.look focused on the detectors of each fishing state, which idle runs all of """
+    results = []
+    eyes = SightTrainer.teach(synthetic_eyes(*SCALING_FIELD))
+    angler = Angler(eyes=eyes)
+    try:
+        for state in FishingState:
+            angler.enter(state)
+            results.append({'case': state.name, 'field': 'x'.join(map(str, SCALING_FIELD)),
+                            **measure(eyes.look, duration=duration)})
+    finally:
+        eyes.close()
+    return results
+
+
+@benchmark('templates')
+def template_scaling(duration, frames=None):
+    """ Eyes.look as the number of learned templates grows, none of which is ever found """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index, template in enumerate(random_templates(max(DETECTOR_COUNTS))):
+            path = pathlib.Path(directory, f'template_{index}.png')
+            cv.imwrite(str(path), template)
+            paths.append(path)
+
+        for count in DETECTOR_COUNTS:
+            eyes = synthetic_eyes(*SCALING_FIELD)
+            for index, path in enumerate(paths[:count]):
+                eyes.learn_image(f'template_{index}', path)
+
+            try:
+                results.append({'field': 'x'.join(map(str, SCALING_FIELD)), 'detectors': count,
+                                **measure(eyes.look, duration=duration)})
+            finally:
+                eyes.close()
+    return results
+
+
+@benchmark('triggers')
+def trigger_scaling(duration, frames=None):
+    """ Eyes.look as the number of learned trigger colors grows, none of which is ever found """
+    results = []
+    for count in DETECTOR_COUNTS:
+        eyes = synthetic_eyes(*SCALING_FIELD)
+        for index, color in enumerate(trigger_colors(count)):
+            eyes.learn_trigger(f'trigger_{index}', color)
+
+        try:
+            results.append({'field': 'x'.join(map(str, SCALING_FIELD)), 'detectors': count,
+                            **measure(eyes.look, duration=duration)})
+        finally:
+            eyes.close()
+    return results
+
+
+@benchmark('learn')
+def learn_images(duration, frames=None):
+    """ SightTrainer.teach with the shipped images, decoding them each time or loading them from a warm cache """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for case, cache in (('uncached', None), ('cached', TemplateCache(directory))):
+            def teach():
+                SightTrainer.teach(Eyes(0, 0, *SCALING_FIELD, change_threshold=0, workers=0, template_cache=cache))
+
+            results.append({'case': case, **measure(teach, duration=duration)})
+    return results
+
+
+@benchmark('replay')
+def recorded_frames(duration, frames=None):
+    """ Eyes.look over recorded frames with the configured detectors, skipped unless frames are given """
+    if frames is None:
+        logger.info('No recorded frames given, skipping the replay benchmark')
+        return []
+
+    field = get_settings().sample.field
+    eyes = SightTrainer.teach(
+        Eyes(*field, source=ReplaySource(frames, loop=True, field=field), pool=FramePool(), workers=0)
+    )
+    try:
+        return [{'case': str(frames), **measure(eyes.look, duration=duration)}]
+    finally:
+        eyes.close()
+
+
+__all__ = ['synthetic_eyes']
@@ -1,9 +1,15 @@
 import click
 import click_log
+import io
+import json
 import logging
+import os
+import pathlib
+import signal
+import time
 
-from ..core import CaptainAhab
-
+# NumPy, OpenCV, PIL and the core are imported by the commands which use them, so --help and quick commands such as
+# config don't pay for them
 
 logger = logging.getLogger(__name__)
 click_log.basic_config(logger)
@@ -18,8 +24,204 @@ def cli():
 @cli.command()
 def start():
     """ Start CaptainAhab (hit Ctrl+C to kill) """
+    from ..core import CaptainAhab
     CaptainAhab.run()
 
 
+@cli.command()
+@click.argument('configs', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--status-interval', type=float, default=None,
+              help='Seconds between status reports (default: [fleet] status_interval)')
+@click.option('--snapshots', type=click.Path(file_okay=False), default=None,
+              help='Save the latest frame of each captain here (default: [fleet] snapshot_dir)')
+def fleet(configs, status_interval, snapshots):
+    """
+    Run one CaptainAhab per game window, each from its own configuration file (hit Ctrl+C to stop them all)
+
+    The captains are read from the [captains] configuration section unless configuration files are given, in which
+    case each is named after its file.
+    """
+    from ..core.fleet import format_status, get_fleet
+    from ..utils.logs import configure_logging
+
+    configure_logging()
+    captains = {pathlib.Path(path).stem: pathlib.Path(path) for path in configs}
+    try:
+        fleet = get_fleet(captains, status_interval=status_interval, snapshot_dir=snapshots)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+    fleet.run(report=lambda status: click.echo(f'\n{format_status(status)}'))
+
+
+@cli.command()
+def config():
+    """ Show the configuration in effect, as a configuration file, and where it was read from """
+    from ..utils.settings import get_settings
+
+    settings = get_settings()
+    click.echo(f'# {settings.path or "No configuration file found, using the defaults"}\n')
+
+    stream = io.StringIO()
+    settings.to_config().write(stream)
+    click.echo(stream.getvalue().rstrip())
+
+
+@cli.command()
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--fps', type=float, default=None, help='Replay frame rate (default: as fast as possible)')
+@click.option('--frames', type=int, default=None, help='Stop after this many frames')
+@click.option('--workers', type=int, default=None, help='Detector threads (default: [vision] detector_workers)')
+@click.option('--track-padding', type=int, default=None,
+              help='Pixels searched around the last match first; 0 disables tracking (default: [vision] track_padding)')
+@click.option('--metrics', is_flag=True, help='Also report per-span latencies from the instrumentation')
+def replay(path, fps, frames, workers, track_padding, metrics):
+    """ Run the vision pipeline against a recorded session and report throughput """
+    import asyncio
+    from ..core.capture import ReplaySource
+    from ..core.sight import Eyes
+    from ..core.trainers import SightTrainer
+    from ..utils.instruments import instruments, format_snapshot
+    from ..utils.logs import configure_logging
+    from ..utils.settings import get_settings
+
+    configure_logging()
+    if metrics:
+        instruments.enabled = True
+
+    field = get_settings().sample.field
+    source = ReplaySource(path, fps=fps, loop=frames is not None, field=field)
+    eyes = SightTrainer.teach(Eyes(*field, source=source, workers=workers, track_padding=track_padding))
+
+    loop = asyncio.new_event_loop()
+    latencies = []
+
+    started = time.perf_counter()
+    try:
+        while frames is None or len(latencies) < frames:
+            tick = time.perf_counter()
+            loop.run_until_complete(eyes.look_async())
+            latencies.append(time.perf_counter() - tick)
+    except EOFError:
+        pass
+    finally:
+        eyes.close()
+        loop.close()
+    elapsed = time.perf_counter() - started
+
+    if not latencies:
+        raise click.ClickException(f'No frames replayed from {path}')
+
+    latencies.sort()
+    click.echo(f'frames: {len(latencies)}')
+    click.echo(f'fps: {len(latencies) / elapsed:.2f}')
+    for label, quantile in (('p50', 0.5), ('p95', 0.95), ('max', 1.0)):
+        latency = latencies[min(len(latencies) - 1, int(quantile * len(latencies)))]
+        click.echo(f'{label} latency: {latency * 1000:.2f}ms')
+
+    if eyes.change_detector is not None:
+        click.echo(f'unchanged frames: {eyes.change_detector.hits} ({eyes.change_detector.hit_rate:.1%})')
+
+    if eyes.tracker is not None:
+        click.echo(f'track hits: {eyes.tracker.hits} ({eyes.tracker.hit_rate:.1%}), misses: {eyes.tracker.misses}')
+
+    if metrics:
+        click.echo(format_snapshot(instruments.snapshot()))
+
+
+@cli.command()
+@click.argument('path', type=click.Path(dir_okay=False), required=False)
+@click.option('--pid', type=int, default=None, help='Ask the CaptainAhab with this process id for a fresh dump')
+@click.option('--timeout', type=float, default=5.0, help='Seconds to wait for the dump asked for with --pid')
+def metrics(path, pid, timeout):
+    """
+    Show the instrumentation last dumped by a running or stopped CaptainAhab
+
+    A captain dumps its metrics when it stops and when it receives SIGUSR1 (Ctrl+Break on Windows), which --pid sends
+    before waiting for the new dump.
+    """
+    from ..utils.instruments import format_snapshot
+    from ..utils.settings import get_settings
+
+    path = path or get_settings().instrumentation.dump_path
+    if not path:
+        raise click.ClickException('No metrics file given and [instrumentation] dump_path is not set')
+
+    if pid is not None:
+        request_dump(pid, pathlib.Path(path), timeout)
+
+    try:
+        with open(path) as metrics_file:
+            snapshot = json.load(metrics_file)
+    except FileNotFoundError:
+        raise click.ClickException(
+            f'No metrics at {path}: a captain with [instrumentation] enabled writes them when it stops, or when asked '
+            f'with --pid'
+        )
+
+    click.echo(f'elapsed: {snapshot["elapsed"]:.1f}s')
+    click.echo(format_snapshot(snapshot))
+
+
+def request_dump(pid, path, timeout):
+    """ Signal the captain running as `pid` to dump its metrics and wait until `path` has been rewritten """
+    dumped = path.stat().st_mtime_ns if path.exists() else None
+    try:
+        os.kill(pid, getattr(signal, 'SIGUSR1', None) or signal.CTRL_BREAK_EVENT)
+    except OSError as error:
+        raise click.ClickException(f'Unable to signal process {pid}: {error}')
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if path.exists() and path.stat().st_mtime_ns != dumped:
+            return
+        time.sleep(0.05)
+
+    raise click.ClickException(
+        f'Process {pid} did not dump its metrics to {path} within {timeout:g}s; is [instrumentation] enabled and '
+        f'dump_path the same for it?'
+    )
+
+
+@cli.command()
+@click.option('--only', multiple=True,
+              help='Run only these benchmarks (capture, look, states, templates, triggers, learn, replay, scheduler, '
+                   'timers, loop, timing, startup)')
+@click.option('--duration', type=float, default=1.0, help='Seconds to spend on each measurement')
+@click.option('--frames', type=click.Path(exists=True), default=None,
+              help='Recorded frames (as accepted by replay) to also benchmark')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Write the JSON report here')
+@click.option('--compare', 'baseline', type=click.File(), default=None,
+              help='An earlier JSON report to compare throughput against')
+def bench(only, duration, frames, output, baseline):
+    """ Benchmark the vision and scheduling hot paths, reporting JSON """
+    import dataclasses
+    from ..bench import BENCHMARKS, run_benchmarks, compare
+    from ..utils.logs import configure_logging
+    from ..utils.settings import get_settings, use_settings
+
+    unknown = [name for name in only if name not in BENCHMARKS]
+    if unknown:
+        raise click.BadParameter(f'Unknown benchmark: {", ".join(unknown)}', param_hint='--only')
+
+    # The timed loops run with warnings only and no debug output, whatever the configuration asks for, so that
+    # reports from different setups can be compared
+    settings = get_settings()
+    configure_logging(use_settings(dataclasses.replace(
+        settings,
+        captain=dataclasses.replace(settings.captain, verbosity=0),
+        logging=dataclasses.replace(settings.logging, log_level=logging.WARNING)
+    )))
+    report = run_benchmarks(names=only, duration=duration, frames=frames)
+    output.write(json.dumps(report, indent=2))
+    output.write('\n')
+
+    if baseline is not None:
+        previous = json.load(baseline)
+        click.echo(f'Compared with {previous.get("commit") or baseline.name}:', err=True)
+        for case, before, after, ratio in compare(previous, report):
+            click.echo(f'{case:<40}{before:>14.1f}/s{after:>14.1f}/s{ratio:>9.2f}x', err=True)
+
+
 if __name__ == '__main__':
     cli(prog_name='captain-ahab')
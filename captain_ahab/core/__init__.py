@@ -1,8 +1,8 @@
+import functools
 import logging
-from typing import Coroutine
-from queue import PriorityQueue, Empty
 from ..utils import Singleton
-from ..utils.constants import SAMPLE_X, SAMPLE_Y, SAMPLE_W, SAMPLE_H
+from ..utils.logs import configure_logging
+from ..utils.settings import get_settings
 from .actions import *
 from .trainers import SightTrainer, MovementTrainer, VoiceTrainer, FishingTrainer
 from .angler import Angler
@@ -11,6 +11,8 @@ from .mobility import Legs
 from .voice import Voice
 from .cortex import Cortex
 from .liaison import AnimaLiaison
+from .scheduler import ActionScheduler
+from .inputs import get_input_backend
 
 
 logger = logging.getLogger(__name__)
@@ -26,15 +28,19 @@ class CaptainAhab(metaclass=Singleton):
 
     @classmethod
     def run(cls, x=None, y=None, w=None, h=None):
-        x = x or SAMPLE_X
-        y = y or SAMPLE_Y
-        w = w or SAMPLE_W
-        h = h or SAMPLE_H
+        settings = get_settings()
+        configure_logging(settings, truncate=True)
+
+        x = x or settings.sample.x
+        y = y or settings.sample.y
+        w = w or settings.sample.right
+        h = h or settings.sample.bottom
         captain = cls(x, y, w, h)
         AnimaLiaison(captain=captain).dispatch()
 
-    def __init__(self, visual_x, visual_y, visual_width, visual_height):
-        self.action_queue = PriorityQueue()
+    def __init__(self, visual_x, visual_y, visual_width, visual_height, inputs=None):
+        self.action_queue = ActionScheduler()
+        self.inputs = inputs or get_input_backend()
         self.action_wait_timeout = 0.5
         self.visual_field = (visual_x, visual_y, visual_width, visual_height)
         self.eyes = None
@@ -42,9 +48,12 @@ class CaptainAhab(metaclass=Singleton):
         self.voice = None
         self.angler = None
         self.cortex = Cortex()
+        self._actions = {}
+        self._plans = {}
         logger.debug('CaptainAhab lives')
         self.__initialized = False
         self.__dead = False
+        self.__failed = False
 
     @property
     def ready(self):
@@ -54,9 +63,18 @@ class CaptainAhab(metaclass=Singleton):
     def alive(self):
         return not self.__dead
 
-    def kill(self):
+    @property
+    def failed(self):
+        """ True when the captain died of an error rather than being stopped """
+        return self.__failed
+
+    def kill(self, failed=False):
         logger.info(f'CaptainAhab has died')
         self.__dead = True
+        self.__failed = self.__failed or failed
+
+        if self.eyes is not None:
+            self.eyes.close()
 
     async def update(self):
         if self.__dead:
@@ -75,38 +93,69 @@ class CaptainAhab(metaclass=Singleton):
         logger.debug('CaptainAhab has finished training')
         self.__initialized = True
 
-    async def perform_next_action(self) -> Coroutine:
+    async def perform_next_action(self, timeout=None):
+        queued_item = await self.action_queue.get(timeout=self.action_wait_timeout if timeout is None else timeout)
+        return await self.perform_action(queued_item)
+
+    async def perform_action(self, queued_item):
         try:
-            queued_item = self.action_queue.get(timeout=self.action_wait_timeout)
-            result = queued_item.action.invoke()
-            self.action_queue.task_done()
-            return result
-        except Empty:
-            raise
+            return await queued_item.action.invoke_async()
+        except EOFError:
+            # A replayed session running out ends the run, as it does in the pipeline
+            logger.info('Capture source exhausted')
+            self.kill()
         except Exception:
             logger.exception(f'Error during queued task')
-            self.kill()
+            self.kill(failed=True)
+        finally:
+            self.action_queue.recycle(queued_item)
 
     def purge_queue(self):
-        qsize = self.action_queue.qsize()
+        qsize = self.action_queue.purge()
+        logger.debug('Purged queue: %s', qsize)
+
+    def action(self, action_cls):
+        """ The captain's instance of an action class; actions keep nothing between invocations, so one is shared """
+        action = self._actions.get(action_cls)
+        if action is None:
+            action = self._actions[action_cls] = action_cls(captain=self)
+        return action
+
+    def plan(self, action_list, priority=None) -> ActionPlan:
+        """ The ActionPlan queueing the given action classes in order, compiled on first use """
+        key = (tuple(action_list), priority)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = ActionPlan(
+                (self.action(action_cls), priority or action_cls.default_priority) for action_cls in action_list
+            )
+        return plan
+
+    def queue_plan(self, plan):
+        for action, priority in plan.steps:
+            self.action_queue.put(action, priority=priority)
+            logger.debug('Queued %s', action)
 
-        with self.action_queue.mutex:
-            self.action_queue.queue.clear()
+    def queue_action(self, action_cls, priority=None):
+        self.queue_plan(self.plan((action_cls,), priority=priority))
 
-        logger.debug(f'Purged queue: {qsize}')
+    def schedule_action(self, action_cls, delay, repeat=False, priority=None):
+        """ Queue an action once `delay` seconds have passed (and every `delay` seconds after, if `repeat`) """
+        return self.cortex.start_timer(
+            name=action_cls.__name__,
+            duration=delay,
+            callback=functools.partial(self.queue_action, action_cls, priority=priority),
+            repeat=repeat
+        )
 
-    def queue_action(self, action_cls, priority=None):
-        action = action_cls(captain=self)
-        self.action_queue.put(PrioritizedAction(priority=priority or action_cls.default_priority,
-                                                action=action))
-        logger.debug(f'Queued {action}')
+    def cancel_scheduled_action(self, action_cls):
+        self.cortex.purge_timer(action_cls.__name__)
 
     def queue_actions(self, action_list, priority=None):
-        for action_cls in action_list:
-            self.queue_action(action_cls=action_cls, priority=priority)
+        self.queue_plan(self.plan(action_list, priority=priority))
 
     def cast(self):
-        self.queue_actions([CastLine, Wait])
+        self.queue_actions((CastLine, Wait))
 
     def hook(self):
         self.queue_action(HookFish)
@@ -115,7 +164,7 @@ class CaptainAhab(metaclass=Singleton):
         self.queue_action(ReelIn)
 
     def release(self):
-        self.queue_actions([ReleaseTension, Wait])
+        self.queue_actions((ReleaseTension, Wait))
 
     def wait(self):
         self.queue_action(Wait)
@@ -130,10 +179,10 @@ class CaptainAhab(metaclass=Singleton):
         self.queue_action(ShiftPosition)
 
     def move(self):
-        self.queue_actions([Move, Wait])
+        self.queue_actions((Move, Wait))
 
     def speak(self):
-        self.queue_actions([Speak, Wait])
+        self.queue_actions((Speak, Wait))
 
     def look(self):
         self.queue_action(Look)
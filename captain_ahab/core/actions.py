@@ -1,11 +1,11 @@
 import abc
 import logging
-import time
-import win32api
-import win32con
-from dataclasses import dataclass, field
-from ..utils.constants import InputCode, TriggerColors, ImageRegistry, VERBOSITY, fishing_config
+from ..utils.constants import InputCode
+from ..utils.instruments import instruments
+from ..utils.settings import get_settings
+from .angler import FishingState, state_for
 from .randomizer import random_float, random_wait
+from .timepieces import precision_timer
 
 
 logger = logging.getLogger(__name__)
@@ -40,93 +40,172 @@ class Action(metaclass=abc.ABCMeta):
     def _perform_action(self, *args, **kwargs):
         """ Must be implemented in an Action child, execute the given action """
 
-    @staticmethod
-    def press_key(key):
+    async def _perform_action_async(self, *args, **kwargs):
+        """ Execute the given action on the event loop, children which wait should override this to await instead """
+        return self._perform_action(*args, **kwargs)
+
+    @property
+    def inputs(self):
+        return self.captain.inputs
+
+    def press_key(self, key):
         if isinstance(key, str):
             key = InputCode[key]
 
-        win32api.keybd_event(key.value, 0, 0, 0)
+        self.inputs.press_key(key.value)
 
-    @staticmethod
-    def release_key(key):
+    def release_key(self, key):
         if isinstance(key, str):
             key = InputCode[key]
 
-        win32api.keybd_event(key.value, 0, win32con.KEYEVENTF_KEYUP, 0)
+        self.inputs.release_key(key.value)
+
+    def point_mouse(self, position):
+        self.inputs.point_mouse(position)
 
-    @staticmethod
-    def point_mouse(position):
-        win32api.SetCursorPos(position)
+    def click_mouse(self):
+        self.inputs.press_mouse()
 
-    @staticmethod
-    def click_mouse():
-        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
+    def release_mouse(self):
+        self.inputs.release_mouse()
 
-    @staticmethod
-    def release_mouse():
-        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
+    @property
+    def label(self) -> str:
+        """ The name the durations this action waits for are recorded under, as timing.<label> """
+        return self.__class__.__name__
+
+    def wait(self, duration):
+        precision_timer.sleep(duration, label=self.label)
 
-    @staticmethod
-    def wait(duration):
-        time.sleep(duration)
+    def wait_range(self, minimum=0.0, maximum=1.0):
+        self.wait(random_float(minimum=minimum, maximum=maximum))
 
-    @staticmethod
-    def wait_range(minimum=0.0, maximum=1.0):
-        time.sleep(random_float(minimum=minimum, maximum=maximum))
+    async def wait_async(self, duration):
+        await precision_timer.sleep_async(duration, label=self.label)
+
+    async def wait_range_async(self, minimum=0.0, maximum=1.0):
+        await self.wait_async(random_float(minimum=minimum, maximum=maximum))
 
     def invoke(self):
-        if VERBOSITY >= 3:
-            logger.debug(f'{self} invoked')
+        if get_settings().captain.verbosity >= 3:
+            logger.debug('%s invoked', self)
+
+        self._prepare()
+        with instruments.span(f'action.{self.__class__.__name__}'):
+            return self._perform_action(*self.args, **self.kwargs)
+
+    async def invoke_async(self):
+        if get_settings().captain.verbosity >= 3:
+            logger.debug('%s invoked', self)
 
         self._prepare()
-        return self._perform_action(*self.args, **self.kwargs)
+        with instruments.span(f'action.{self.__class__.__name__}'):
+            return await self._perform_action_async(*self.args, **self.kwargs)
 
     def click_at(self, position, duration=0.05):
         self.point_mouse(position)
-        self.wait(duration/2)
-        self.click_mouse()
-        self.wait(duration)
-        self.release_mouse()
+        precision_timer.hold(self.click_mouse, self.release_mouse, duration,
+                             start=precision_timer.now() + duration/2, label=self.label)
 
     def keystroke(self, key, duration=0.05):
-        self.press_key(key)
-        self.wait(duration)
-        self.release_key(key)
+        precision_timer.hold(lambda: self.press_key(key), lambda: self.release_key(key), duration, label=self.label)
 
     def random_keystroke(self, key, burst_min, burst_max):
         duration = random_float(burst_min, burst_max)
         self.keystroke(key, duration=duration)
 
+    async def click_at_async(self, position, duration=0.05):
+        self.point_mouse(position)
+        # A cancelled click must not leave the button held down, which hold_async sees to
+        await precision_timer.hold_async(self.click_mouse, self.release_mouse, duration,
+                                         start=precision_timer.now() + duration/2, label=self.label)
+
+    async def keystroke_async(self, key, duration=0.05):
+        # Nor a cancelled keystroke the key
+        await precision_timer.hold_async(lambda: self.press_key(key), lambda: self.release_key(key), duration,
+                                         label=self.label)
+
+    async def random_keystroke_async(self, key, burst_min, burst_max):
+        duration = random_float(burst_min, burst_max)
+        await self.keystroke_async(key, duration=duration)
+
 
-@dataclass(order=True)
 class PrioritizedAction:
-    priority: int
-    action: Action = field(compare=False)
+    """ A queued action, ordered by priority then by `sequence`, so equal priorities run in the order queued """
+
+    # Records are recycled by the ActionScheduler rather than allocated per action
+    __slots__ = ('priority', 'action', 'sequence')
+
+    def __init__(self, priority=0, action=None, sequence=0):
+        self.priority = priority
+        self.action = action
+        self.sequence = sequence
+
+    def __repr__(self):
+        return f'PrioritizedAction(priority={self.priority}, action={self.action}, sequence={self.sequence})'
+
+    def __lt__(self, other):
+        if self.priority != other.priority:
+            return self.priority < other.priority
+        return self.sequence < other.sequence
+
+
+class ActionPlan:
+    """
+    A precompiled sequence of (action, priority) steps
+
+    CaptainAhab.plan builds each distinct sequence once, with the captain's shared action instances, so queueing a
+    plan only pushes its steps onto the scheduler.
+    """
+
+    __slots__ = ('steps',)
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+
+    def __repr__(self):
+        return f'ActionPlan({", ".join(f"{action}@{priority}" for action, priority in self.steps)})'
 
 
 class KeyStroke(Action, metaclass=abc.ABCMeta):
-    config = NotImplemented
+    config_section = NotImplemented
     config_delay_key = NotImplemented
-    keystroke = None
+    key = None
+    _settings = None
 
     def _prepare(self):
-        self.kwargs['burst_min'] = int(self.config[f'{self.config_delay_key}_min'])
-        self.kwargs['burst_max'] = int(self.config[f'{self.config_delay_key}_max'])
+        # The burst range is looked up once per settings object, so again only after the settings are reloaded
+        settings = get_settings()
+        if settings is not self._settings:
+            config = getattr(settings, self.config_section)
+            self._settings = settings
+            self.kwargs['burst_min'] = getattr(config, f'{self.config_delay_key}_min')
+            self.kwargs['burst_max'] = getattr(config, f'{self.config_delay_key}_max')
 
     def _perform_action(self, burst_min, burst_max):
-        if self.keystroke:
-            logger.debug(f'Pressing {self.keystroke} for ({burst_min}-{burst_max})s')
-            self.random_keystroke(key=self.keystroke, burst_min=burst_min, burst_max=burst_max)
+        if self.key:
+            logger.debug('Pressing %s for (%s-%s)s', self.key, burst_min, burst_max)
+            self.random_keystroke(key=self.key, burst_min=burst_min, burst_max=burst_max)
+
+    async def _perform_action_async(self, burst_min, burst_max):
+        if self.key:
+            logger.debug('Pressing %s for (%s-%s)s', self.key, burst_min, burst_max)
+            await self.random_keystroke_async(key=self.key, burst_min=burst_min, burst_max=burst_max)
 
 
 class FishingKeyStroke(KeyStroke):
-    config = fishing_config
-    keystroke = InputCode.e
+    config_section = 'fishing'
+    key = InputCode.e
 
 
 class CastLine(FishingKeyStroke):
     config_delay_key = 'cast_delay'
 
+    def _prepare(self):
+        super()._prepare()
+        if self.captain.angler is not None:
+            self.captain.angler.enter(FishingState.cast)
+
 
 class HookFish(FishingKeyStroke):
     config_delay_key = 'hook_delay'
@@ -143,7 +222,7 @@ class ReleaseTension(Action):
         pass
 
     def _perform_action(self):
-        logger.debug(f'Releasing {InputCode.e}')
+        logger.debug('Releasing %s', InputCode.e)
         self.release_key(InputCode.e)
         self.captain.purge_queue()
 
@@ -155,9 +234,13 @@ class Wait(Action):
         self.kwargs['delay'] = random_wait()
 
     def _perform_action(self, delay):
-        logger.debug(f'Waiting {delay}s')
+        logger.debug('Waiting %ss', delay)
         self.wait(delay)
 
+    async def _perform_action_async(self, delay):
+        logger.debug('Waiting %ss', delay)
+        await self.wait_async(delay)
+
 
 class RepairGear(Action):
     def _prepare(self):
@@ -204,26 +287,31 @@ class Look(Action):
         pass
 
     def _perform_action(self):
-        found = self.captain.eyes.look()
+        self.react(self.captain.eyes.look())
+
+    async def _perform_action_async(self):
+        self.react(await self.captain.eyes.look_async())
+
+    def react(self, found):
+        """ Advance the angler's fishing state and queue the actions called for by what the eyes found """
+        if self.captain.angler is not None:
+            self.captain.angler.observe(found)
 
         if found is None:
-            logger.debug(f'CaptainAhab did not notice anything')
-        else:
-            logger.info(f'CaptainAhab saw {found}')
-            if isinstance(found, set):
-                for match in found:
-                    if match is TriggerColors.safe_tension:
-                        self.captain.reel()
-                    elif match is TriggerColors.medium_tension:
-                        self.captain.release()
-                    elif match is TriggerColors.unsafe_tension:
-                        self.captain.release()
-            elif isinstance(found, ImageRegistry):
-                if found is ImageRegistry.line_cast:
-                    self.captain.wait()
-                elif found is ImageRegistry.fish_hooked:
-                    self.captain.hook()
+            logger.debug('CaptainAhab did not notice anything')
+            return
+
+        logger.info('CaptainAhab saw %s', found)
+        state = state_for(found)
+        if state is FishingState.waiting:
+            self.captain.wait()
+        elif state is FishingState.hooked:
+            self.captain.hook()
+        elif state is FishingState.reeling:
+            self.captain.reel()
+        elif state is FishingState.recovering:
+            self.captain.release()
 
 
 __all__ = ['CastLine', 'HookFish', 'ReelIn', 'ReleaseTension', 'Wait', 'RepairGear', 'EquipBait', 'ShiftPosition',
-           'PrioritizedAction', 'Speak', 'Move', 'Look']
+           'PrioritizedAction', 'ActionPlan', 'Speak', 'Move', 'Look']
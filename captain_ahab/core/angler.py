@@ -1,10 +1,111 @@
+import enum
+import logging
+import time
+from typing import Optional
+from ..utils.constants import ImageRegistry, TriggerColors
+from ..utils.settings import get_settings
+from .sight import Detection
+
+
+logger = logging.getLogger(__name__)
+
+TENSION_COLORS = frozenset({TriggerColors.safe_tension, TriggerColors.medium_tension, TriggerColors.unsafe_tension})
+# Tension a reeled fish cannot take; the line must be released until it is back to safe
+DANGEROUS_TENSION = frozenset({TriggerColors.medium_tension, TriggerColors.unsafe_tension})
+
+
+class FishingState(enum.Enum):
+    idle = 'idle'
+    cast = 'cast'
+    waiting = 'waiting'
+    hooked = 'hooked'
+    reeling = 'reeling'
+    recovering = 'recovering'
+
+
+# The images and trigger colors worth looking for in each state; idle does not know where it is, so looks for all
+STATE_DETECTORS = {
+    FishingState.idle: (None, None),
+    FishingState.cast: ({ImageRegistry.line_cast}, set()),
+    FishingState.waiting: ({ImageRegistry.fish_hooked}, set()),
+    FishingState.hooked: (set(), TENSION_COLORS),
+    FishingState.reeling: (set(), TENSION_COLORS),
+    FishingState.recovering: (set(), TENSION_COLORS)
+}
+
+# The [fishing] option holding the seconds each state lasts without anything relevant being seen
+STATE_TIMEOUTS = {
+    FishingState.cast: 'cast_timeout',
+    FishingState.waiting: 'bite_timeout',
+    FishingState.hooked: 'fight_timeout',
+    FishingState.reeling: 'fight_timeout',
+    FishingState.recovering: 'fight_timeout'
+}
+
+
+def state_for(found) -> Optional[FishingState]:
+    """ The fishing state a look's result shows the captain to be in, None when it shows nothing relevant """
+    if isinstance(found, Detection):
+        if found.target is ImageRegistry.line_cast:
+            return FishingState.waiting
+        if found.target is ImageRegistry.fish_hooked:
+            return FishingState.hooked
+    elif found:
+        if found & DANGEROUS_TENSION:
+            return FishingState.recovering
+        if TriggerColors.safe_tension in found:
+            return FishingState.reeling
+    return None
 
 
 class Angler:
-    """ The Angler class provides fishing capabilities to CaptainAhab """
+    """
+    The Angler class provides fishing capabilities to CaptainAhab
+
+    The Angler follows the phase of fishing from what the eyes see (and the line being cast), keeping the eyes focused
+    on the detectors relevant to it: waiting for a bite only matches the fish_hooked image, fighting a fish only the
+    tension colors.  A state in which nothing relevant is seen for its timeout falls back to idle, where every
+    detector runs again.
+    """
+
+    def __init__(self, eyes=None):
+        self.eyes = eyes
+        self.state = None
+        self.entered = self.last_seen = time.monotonic()
+        self.enter(FishingState.idle)
+
+    def enter(self, state):
+        if state is self.state:
+            return
+
+        logger.debug('Fishing state: %s -> %s', self.state and self.state.name, state.name)
+        self.state = state
+        self.entered = self.last_seen = time.monotonic()
+        if self.eyes is not None:
+            images, triggers = STATE_DETECTORS[state]
+            self.eyes.focus(
+                images=None if images is None else {image.name for image in images},
+                triggers=None if triggers is None else {trigger.name for trigger in triggers}
+            )
+
+    @property
+    def timeout(self) -> Optional[float]:
+        """ Seconds the current state lasts without anything relevant being seen, None when it never times out """
+        option = STATE_TIMEOUTS.get(self.state)
+        return getattr(get_settings().fishing, option) if option else None
+
+    def observe(self, found) -> FishingState:
+        """ Advance on the result of a look, returning the state the captain is now in """
+        now = time.monotonic()
+        state = state_for(found)
+        if state is not None:
+            self.enter(state)
+            self.last_seen = now
+        elif self.timeout is not None and now - self.last_seen > self.timeout:
+            logger.debug('Nothing seen for %.1fs while %s', now - self.last_seen, self.state.name)
+            self.enter(FishingState.idle)
 
-    def __init__(self):
-        pass
+        return self.state
 
 
-__all__ = ['Angler']
+__all__ = ['Angler', 'FishingState', 'state_for']
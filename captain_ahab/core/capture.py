@@ -0,0 +1,561 @@
+import abc
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import threading
+import time
+import numpy
+from multiprocessing import shared_memory
+from PIL import ImageGrab
+from cv2 import cv2 as cv
+from ..utils.settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp')
+# Names the shared memory block a fleet worker captures into, see SharedFramePool
+SHARED_FRAMES_VARIABLE = 'CAPTAIN_AHAB_SHARED_FRAMES'
+
+
+class CaptureSource(metaclass=abc.ABCMeta):
+    """ Abstract base class from which all frame sources will be derived """
+
+    @abc.abstractmethod
+    def grab(self, bbox):
+        """ Must be implemented in a CaptureSource child, return the given field as an RGB numpy array """
+
+    def grab_into(self, bbox, out):
+        """ Write the given field into a preallocated RGB buffer, children should avoid the intermediate copy """
+        numpy.copyto(out, self.grab(bbox))
+        return out
+
+    def frame_shape(self, bbox):
+        left, top, right, bottom = bbox
+        return bottom - top, right - left, 3
+
+    def close(self):
+        pass
+
+
+class ImageGrabSource(CaptureSource):
+    """ Captures the live desktop using PIL.ImageGrab """
+
+    def grab(self, bbox):
+        return numpy.array(ImageGrab.grab(bbox=bbox))
+
+    def grab_into(self, bbox, out):
+        # asarray exposes the grabbed pixels without the extra copy made by numpy.array
+        numpy.copyto(out, numpy.asarray(ImageGrab.grab(bbox=bbox)))
+        return out
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int)
+    ]
+
+
+class XImage(ctypes.Structure):
+    # Only the leading members read here; the structure is always allocated by Xlib
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong)
+    ]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte)
+    ]
+
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+Z_PIXMAP = 2
+ALL_PLANES = ctypes.c_ulong(-1).value
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+_xlib = None
+_x_errors = []
+
+
+@X_ERROR_HANDLER
+def _record_x_error(display, event):
+    # Xlib's default handler exits the process, so errors are noted here and reported by the failing call instead
+    _x_errors.append(event.contents.error_code)
+    return 0
+
+
+def _load_xlib():
+    """ libX11, libXext and libc with the signatures used by XShmSource, loaded on first use """
+    global _xlib
+
+    if _xlib is None:
+        libraries = [ctypes.util.find_library(name) for name in ('X11', 'Xext', 'c')]
+        if not all(libraries):
+            raise ValueError('The xshm capture source needs libX11 and libXext')
+        x11, xext, libc = (ctypes.CDLL(library, use_errno=True) for library in libraries)
+
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(XImage)]
+        x11.XSetErrorHandler.argtypes = [X_ERROR_HANDLER]
+        x11.XSetErrorHandler.restype = ctypes.c_void_p
+
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+            ctypes.POINTER(XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint
+        ]
+        xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage), ctypes.c_int, ctypes.c_int, ctypes.c_ulong
+        ]
+
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+        x11.XSetErrorHandler(_record_x_error)
+        _xlib = (x11, xext, libc)
+
+    return _xlib
+
+
+class XShmSource(CaptureSource):
+    """
+    Captures an X11 display through the MIT-SHM extension, straight from shared memory into the frame buffer
+
+    The X server copies the requested area into a System V shared memory segment which is mapped here as a NumPy
+    array, so a grab is one round trip with no pixels sent over the socket, and `grab_into` converts them into the
+    pooled buffer in the same pass.  The segment is sized for the bbox of the first grab and rebuilt when the size
+    changes.  `display` names the X display, $DISPLAY by default; an Xvfb server works for headless runs.  Only
+    32 bits per pixel TrueColor displays (the usual 24-bit depth) are supported.
+
+    Grabs and `close` hold a lock, so closing from another thread (CaptainAhab.kill while the pipeline's capture
+    thread is grabbing) waits for the grab in progress before the segment and display go; later grabs raise
+    EOFError, ending the capture as an exhausted source would.
+    """
+
+    def __init__(self, display=None):
+        self._x11, self._xext, self._libc = _load_xlib()
+        self._display = self._x11.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise ValueError(f'Unable to open X display {display or os.environ.get("DISPLAY")}')
+
+        if not self._xext.XShmQueryExtension(self._display):
+            self._x11.XCloseDisplay(self._display)
+            raise ValueError('The X server does not support the MIT-SHM extension')
+
+        screen = self._x11.XDefaultScreen(self._display)
+        self._root = self._x11.XRootWindow(self._display, screen)
+        self._visual = self._x11.XDefaultVisual(self._display, screen)
+        self._depth = self._x11.XDefaultDepth(self._display, screen)
+        self._image = None
+        self._segment = None
+        self._pixels = None
+        self._lock = threading.Lock()
+
+    def grab(self, bbox):
+        return self.grab_into(bbox, numpy.empty(self.frame_shape(bbox), dtype=numpy.uint8))
+
+    def grab_into(self, bbox, out):
+        left, top, right, bottom = bbox
+        with self._lock:
+            if not self._display:
+                raise EOFError('The X display has been closed')
+
+            self._prepare(right - left, bottom - top)
+
+            del _x_errors[:]
+            if not self._xext.XShmGetImage(self._display, self._root, self._image, left, top, ALL_PLANES):
+                raise ValueError(f'Unable to capture {bbox} from the X display (error {_x_errors or "unknown"})')
+
+            # The server writes BGRX pixels; dropping X and swapping to RGB is the only copy made
+            return cv.cvtColor(self._pixels, cv.COLOR_BGRA2RGB, dst=out)
+
+    def _prepare(self, width, height):
+        if self._pixels is not None and self._pixels.shape[:2] == (height, width):
+            return
+
+        self._release()
+        segment = XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(
+            self._display, self._visual, self._depth, Z_PIXMAP, None, ctypes.byref(segment), width, height
+        )
+        if not image:
+            raise ValueError(f'Unable to create a {width}x{height} shared memory image')
+        self._image = image
+
+        try:
+            self._attach(image, segment, width, height)
+        except BaseException:
+            # Whatever was set up before the failure goes, the image included, so the next grab starts afresh
+            self._release()
+            raise
+
+    def _attach(self, image, segment, width, height):
+        if image.contents.bits_per_pixel != 32 or image.contents.red_mask != 0xFF0000:
+            raise ValueError(f'Unsupported X display format: {image.contents.bits_per_pixel} bits per pixel')
+
+        size = image.contents.bytes_per_line * height
+        segment.shmid = self._libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if segment.shmid < 0:
+            raise OSError(ctypes.get_errno(), f'Unable to allocate a {size} byte shared memory segment')
+
+        address = self._libc.shmat(segment.shmid, None, 0)
+        # Removal is requested straight away, so the segment goes with the last detach even if this process dies
+        self._libc.shmctl(segment.shmid, IPC_RMID, None)
+        if address in (None, ctypes.c_void_p(-1).value):
+            raise OSError(ctypes.get_errno(), 'Unable to attach the shared memory segment')
+
+        segment.shmaddr = image.contents.data = address
+        segment.readOnly = False
+        self._segment = segment
+        del _x_errors[:]
+        attached = self._xext.XShmAttach(self._display, ctypes.byref(segment))
+        # Errors arrive asynchronously, a remote server failing to attach only reports it once synced
+        self._x11.XSync(self._display, False)
+        if not attached or _x_errors:
+            raise ValueError('The X server could not attach the shared memory segment; is it on another host?')
+
+        rows = numpy.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address))
+        self._pixels = rows.reshape(height, image.contents.bytes_per_line // 4, 4)[:, :width]
+        logger.debug(f'Attached a {width}x{height} shared memory image')
+
+    def _release(self):
+        self._pixels = None
+        if self._segment is not None:
+            self._xext.XShmDetach(self._display, ctypes.byref(self._segment))
+            self._x11.XSync(self._display, False)
+            self._libc.shmdt(ctypes.c_void_p(self._segment.shmaddr))
+            self._segment = None
+        if self._image is not None:
+            # Xlib frees the image structure only; the pixels were the segment's
+            self._image.contents.data = None
+            self._x11.XDestroyImage(self._image)
+            self._image = None
+
+    def close(self):
+        with self._lock:
+            if self._display:
+                self._release()
+                self._x11.XCloseDisplay(self._display)
+                self._display = None
+
+
+class FramePool:
+    """
+    A fixed set of preallocated color and grayscale frame buffers handed out round-robin
+
+    Buffers are only reallocated when the requested frame shape changes, so steady-state sampling reuses the same
+    memory every tick.  A buffer is overwritten `size` samples after it was acquired.
+    """
+
+    def __init__(self, size=2):
+        if size < 1:
+            raise ValueError(f'A frame pool needs at least one buffer: {size}')
+
+        self.size = size
+        self.shape = None
+        self._color = []
+        self._gray = []
+        self._cursor = 0
+
+    def allocate(self, shape):
+        height, width = shape[:2]
+        self.shape = (height, width)
+        self._color = [numpy.empty((height, width, 3), dtype=numpy.uint8) for _ in range(self.size)]
+        self._gray = [numpy.empty((height, width), dtype=numpy.uint8) for _ in range(self.size)]
+        self._cursor = 0
+        logger.debug(f'Allocated {self.size} frame buffers of {width}x{height}')
+
+    @property
+    def buffers(self):
+        return list(zip(self._color, self._gray))
+
+    def acquire(self, shape):
+        if tuple(shape[:2]) != self.shape:
+            self.allocate(shape)
+
+        index = self._cursor
+        self._cursor = (index + 1) % self.size
+        return self._color[index], self._gray[index]
+
+
+class SharedFramePool(FramePool):
+    """
+    A FramePool whose color buffers live in a named shared memory block, so another process can watch the frames
+
+    The block is created by the reader (see `block_size`) and attached to here by name; the reader unlinks it, which
+    is why the pool is meant for processes started by the reader through multiprocessing.  It starts with a header of
+    four int64 values, frames acquired, height, width and buffer count, followed by the color buffers back to back.
+    Grayscale buffers stay private to the process.  Frames captured into a smaller field than the block was sized for
+    use its leading bytes; a larger field raises a ValueError.
+    """
+
+    HEADER_SIZE = 4 * 8
+
+    def __init__(self, name, size=2):
+        super().__init__(size)
+        self.name = name
+        self._memory = shared_memory.SharedMemory(name=name)
+        self._header = numpy.ndarray((4,), dtype=numpy.int64, buffer=self._memory.buf)
+
+    @classmethod
+    def block_size(cls, shape, size) -> int:
+        """ Bytes needed to share `size` buffers of frames shaped (height, width) """
+        height, width = shape[:2]
+        return cls.HEADER_SIZE + size * height * width * 3
+
+    @staticmethod
+    def frames_acquired(buffer) -> int:
+        """ How many frames have been captured into a block's `buffer` """
+        return int(numpy.ndarray((1,), dtype=numpy.int64, buffer=buffer)[0])
+
+    @classmethod
+    def latest(cls, buffer):
+        """
+        A copy of the newest complete frame in a block's `buffer`, None before two have been captured
+
+        The most recently acquired buffer may still be mid-capture, so the one handed out before it is returned.
+        """
+        acquired, height, width, size = numpy.ndarray((4,), dtype=numpy.int64, buffer=buffer)
+        if acquired < 2:
+            return None
+
+        frame = height * width * 3
+        offset = cls.HEADER_SIZE + (acquired - 2) % size * frame
+        return numpy.ndarray((height, width, 3), dtype=numpy.uint8, buffer=buffer, offset=offset).copy()
+
+    def allocate(self, shape):
+        height, width = shape[:2]
+        if self.block_size(shape, self.size) > self._memory.size:
+            raise ValueError(f'Shared frame block {self.name} is too small for {self.size} frames of {width}x{height}')
+
+        frame = height * width * 3
+        self.shape = (height, width)
+        self._color = [
+            numpy.ndarray((height, width, 3), dtype=numpy.uint8, buffer=self._memory.buf,
+                          offset=self.HEADER_SIZE + index * frame)
+            for index in range(self.size)
+        ]
+        self._gray = [numpy.empty((height, width), dtype=numpy.uint8) for _ in range(self.size)]
+        self._cursor = 0
+        self._header[:] = (0, height, width, self.size)
+        logger.debug(f'Allocated {self.size} shared frame buffers of {width}x{height} in {self.name}')
+
+    def acquire(self, shape):
+        buffers = super().acquire(shape)
+        self._header[0] += 1
+        return buffers
+
+
+class ReplaySource(CaptureSource):
+    """
+    Streams previously recorded frames in place of the live desktop
+
+    The path may be a directory of images (replayed in name order), a video file or a `.npy` stack shaped
+    (frames, height, width, 3).  When `field` gives the screen bbox the recording covers, `grab` crops the requested
+    bbox out of each frame; otherwise the bbox is ignored and whole frames are returned.  When `fps` is set, `grab`
+    blocks until the next frame is due; otherwise frames are returned as fast as they are requested.  An EOFError is
+    raised once the recording is exhausted unless `loop` is set.
+    """
+
+    def __init__(self, path, fps=None, loop=False, field=None):
+        self.path = pathlib.Path(path)
+        self.fps = fps
+        self.loop = loop
+        self.field = field
+        self.frame_count = 0
+        self._index = 0
+        self._stack = None
+        self._files = None
+        self._video = None
+        self._scratch = None
+        self._shape = None
+        self._started = None
+
+        if self.path.is_dir():
+            self._files = sorted(p for p in self.path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+            if not self._files:
+                raise ValueError(f'No replay frames found in {self.path}')
+        elif self.path.suffix.lower() == '.npy':
+            self._stack = numpy.load(str(self.path), mmap_mode='r')
+            if self._stack.ndim != 4:
+                raise ValueError(f'Expected a (frames, height, width, 3) stack: {self.path}')
+        elif self.path.is_file():
+            self._video = cv.VideoCapture(str(self.path))
+            if not self._video.isOpened():
+                raise ValueError(f'Unable to open replay video: {self.path}')
+        else:
+            raise ValueError(f'Invalid replay path (file does not exist): {self.path}')
+
+        logger.debug(f'Replaying frames from {self.path}')
+
+    def __len__(self):
+        if self._files is not None:
+            return len(self._files)
+        if self._stack is not None:
+            return len(self._stack)
+        return int(self._video.get(cv.CAP_PROP_FRAME_COUNT))
+
+    def grab(self, bbox=None):
+        return self.grab_into(bbox, None)
+
+    def grab_into(self, bbox, out):
+        self._pace()
+        frame = self._next_frame()
+
+        if frame is None:
+            if not self.loop or self._index == 0:
+                raise EOFError(f'Replay exhausted after {self.frame_count} frames: {self.path}')
+
+            self.rewind()
+            frame = self._next_frame()
+
+        self._index += 1
+        self.frame_count += 1
+        frame = self._crop(frame, bbox)
+
+        if self._stack is None:
+            # Recorded images and video are stored BGR; the live capture path produces RGB
+            return cv.cvtColor(frame, cv.COLOR_BGR2RGB, dst=out)
+        if out is None:
+            return frame
+
+        numpy.copyto(out, frame)
+        return out
+
+    def frame_shape(self, bbox=None):
+        if self.field is not None and bbox is not None:
+            return super().frame_shape(bbox)
+        if self._stack is not None:
+            return self._stack.shape[1:]
+        if self._files is not None:
+            if self._shape is None:
+                self._shape = cv.imread(str(self._files[0])).shape
+            return self._shape
+        return (int(self._video.get(cv.CAP_PROP_FRAME_HEIGHT)), int(self._video.get(cv.CAP_PROP_FRAME_WIDTH)), 3)
+
+    def rewind(self):
+        self._index = 0
+        if self._video is not None:
+            self._video.set(cv.CAP_PROP_POS_FRAMES, 0)
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+
+    def _pace(self):
+        if not self.fps:
+            return
+
+        if self._started is None:
+            self._started = time.perf_counter()
+            return
+
+        delay = self._started + self.frame_count / self.fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _crop(self, frame, bbox):
+        if self.field is None or bbox is None:
+            return frame
+
+        x, y = self.field[:2]
+        left, top, right, bottom = bbox
+        return frame[top - y:bottom - y, left - x:right - x]
+
+    def _next_frame(self):
+        if self._stack is not None:
+            return self._stack[self._index] if self._index < len(self._stack) else None
+
+        if self._files is not None:
+            if self._index >= len(self._files):
+                return None
+            image = cv.imread(str(self._files[self._index]))
+            if image is None:
+                raise ValueError(f'Unable to read replay frame: {self._files[self._index]}')
+            return image
+
+        ok, image = self._video.read(self._scratch)
+        if not ok:
+            return None
+
+        self._scratch = image
+        return image
+
+
+def get_capture_source(source=None):
+    """ Build the capture source named by the [capture] configuration section """
+
+    settings = get_settings()
+    source = source or settings.capture.source
+
+    if source == 'imagegrab':
+        return ImageGrabSource()
+    if source == 'xshm':
+        return XShmSource(display=settings.capture.display)
+    if source == 'replay':
+        if not settings.capture.replay_path:
+            raise ValueError('A replay_path must be configured to use the replay capture source')
+        return ReplaySource(settings.capture.replay_path, fps=settings.capture.replay_fps,
+                            loop=settings.capture.replay_loop, field=settings.sample.field)
+
+    raise ValueError(f'Unknown capture source: {source}')
+
+
+def get_frame_pool(size=None):
+    """ Build a FramePool when buffered capture is configured, otherwise None """
+
+    size = get_settings().capture.buffer_count if size is None else size
+    shared = os.environ.get(SHARED_FRAMES_VARIABLE)
+    if shared:
+        # A fleet worker always pools its frames, so the supervisor can see them
+        return SharedFramePool(shared, max(size, 2))
+    return FramePool(size) if size else None
+
+
+__all__ = [
+    'CaptureSource', 'ImageGrabSource', 'XShmSource', 'FramePool', 'SharedFramePool', 'ReplaySource',
+    'get_capture_source', 'get_frame_pool'
+]
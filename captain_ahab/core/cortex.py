@@ -1,5 +1,5 @@
 import logging
-from .timepieces import StopWatch, GameClock
+from .timepieces import GameClock, TimerQueue
 from ..utils import Singleton
 
 
@@ -11,19 +11,16 @@ class Cortex(metaclass=Singleton):
 
     def __init__(self):
         self.clock = GameClock()
-        self.timers = {}
+        self.timers = TimerQueue()
 
     async def update(self):
-        logger.debug(f'Updating timers and game clock')
+        logger.debug('Updating timers and game clock')
         self.clock.tick()
-        for timer in self.timers.values():
-            timer.tick()
+        self.timers.fire(now=self.clock.current_time)
 
-    def start_timer(self, name, duration=1):
-        if name in self.timers:
-            raise ValueError(f'{name} already exists in timers list')
-
-        self.timers[name] = StopWatch(max_time=duration)
+    def start_timer(self, name, duration=1, callback=None, repeat=False):
+        """ Call `callback` once `duration` seconds have passed, and every `duration` seconds after if `repeat` """
+        return self.timers.schedule(name, duration, callback=callback, interval=duration if repeat else None)
 
     def purge_timer(self, name):
-        self.timers.pop(name, None)
+        self.timers.cancel(name)
@@ -0,0 +1,311 @@
+import _thread
+import logging
+import multiprocessing
+import os
+import pathlib
+import queue
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+from ..utils.instruments import Instruments, instruments
+from ..utils.settings import Settings, get_settings, reload_settings
+from .capture import SHARED_FRAMES_VARIABLE, SharedFramePool
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the captains to wind down before they are terminated
+STOP_TIMEOUT = 10.0
+# Seconds before restarting a captain that failed, doubled each consecutive failure up to RESTART_BACKOFF_MAX
+RESTART_BACKOFF = 5.0
+RESTART_BACKOFF_MAX = 300.0
+# A captain that stays up this long is considered healthy again, resetting its backoff
+HEALTHY_UPTIME = 60.0
+
+
+def run_captain(name, config_path, frames_name, statuses, stop, status_interval):
+    """
+    Entry point of each fleet worker process
+
+    CaptainAhab and Cortex are singletons, so each captain lives in a process of its own.  The worker reads its own
+    configuration file, captures into the shared frame block `frames_name` and reports its status and instrumentation
+    on `statuses` every `status_interval` seconds.  Setting `stop` interrupts the captain as Ctrl+C would.  A captain
+    which died of an error exits with status 1, so the supervisor restarts it.
+    """
+    # Ctrl+C reaches every process in the console as well as the supervisor, which then sets `stop` too
+    signal.signal(signal.SIGINT, _interrupt_once)
+    os.environ['CAPTAIN_AHAB_CONFIG'] = str(config_path)
+    os.environ[SHARED_FRAMES_VARIABLE] = frames_name
+    reload_settings(config_path)
+    instruments.enabled = True
+
+    reporter = threading.Thread(
+        target=_report_status, args=(name, statuses, stop, status_interval), name='fleet-status', daemon=True
+    )
+    reporter.start()
+
+    from . import CaptainAhab
+    CaptainAhab.run()
+    _put_status(name, statuses)
+    if CaptainAhab.instance is not None and CaptainAhab.instance.failed:
+        sys.exit(1)
+
+
+def _interrupt_once(signum, frame):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def _report_status(name, statuses, stop, status_interval):
+    while not stop.wait(status_interval):
+        _put_status(name, statuses)
+
+    logger.info('Stop requested by the fleet')
+    _thread.interrupt_main()
+
+
+def _put_status(name, statuses):
+    from . import CaptainAhab
+
+    captain = CaptainAhab.instance
+    eyes = captain.eyes if captain is not None else None
+    statuses.put({
+        'name': name,
+        'pid': os.getpid(),
+        'time': time.time(),
+        'alive': captain is not None and captain.alive,
+        'ready': captain is not None and captain.ready,
+        'queued': captain.action_queue.qsize() if captain is not None else 0,
+        'last_detection': None if eyes is None else str(eyes.last_detection),
+        'instruments': instruments.state()
+    })
+
+
+@dataclass
+class FleetMember:
+    """ A captain of the fleet: its configuration, process and shared frame block """
+
+    name: str
+    config_path: pathlib.Path
+    settings: Settings
+    process: Optional[multiprocessing.Process] = None
+    frames: Optional[shared_memory.SharedMemory] = None
+    started: float = 0.0
+    restarts: int = 0
+    failures: int = 0
+    restart_at: Optional[float] = None
+    status: dict = field(default_factory=dict)
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def latest_frame(self):
+        """ The newest frame this captain captured, None until it has captured two """
+        return SharedFramePool.latest(self.frames.buf) if self.frames is not None else None
+
+
+class Fleet:
+    """
+    Supervises one captain process per configured game window
+
+    Each captain runs from its own configuration file, so the windows differ in their [sample_dimensions] (and in
+    anything else, such as log and metrics paths, which should not be shared).  Frames are captured into a shared
+    memory block per captain, which the supervisor reads to save snapshots without copying frames between processes
+    (captains running the [pipeline] capture into buffers of their own, so they report no frames or snapshots).
+    Captains report their status and raw instrumentation periodically; `status` merges the latest reports into one
+    view of the whole fleet.  A captain that exits with an error is restarted after a growing backoff when `restart`
+    is set.
+    """
+
+    def __init__(self, captains: Dict[str, pathlib.Path], status_interval=None, restart=None, snapshot_dir=None):
+        if not captains:
+            raise ValueError('A fleet needs at least one captain, see the [captains] configuration section')
+
+        settings = get_settings().fleet
+        self.status_interval = settings.status_interval if status_interval is None else status_interval
+        self.restart = settings.restart if restart is None else restart
+        self.snapshot_dir = pathlib.Path(snapshot_dir) if snapshot_dir else settings.snapshot_dir
+        self.members = {}
+        for name, config_path in captains.items():
+            member_settings = Settings.load(config_path)
+            if member_settings.path is None:
+                raise ValueError(f'No configuration found for captain {name} at {config_path}')
+            self.members[name] = FleetMember(name, pathlib.Path(config_path), member_settings)
+
+        # Workers are spawned on every platform, so they never inherit the supervisor's threads or handles
+        self._context = multiprocessing.get_context('spawn')
+        self._statuses = self._context.Queue()
+        self._stop = self._context.Event()
+
+    def start(self):
+        for member in self.members.values():
+            sample = member.settings.sample
+            size = max(member.settings.capture.buffer_count, 2)
+            member.frames = shared_memory.SharedMemory(
+                create=True, size=SharedFramePool.block_size((sample.height, sample.width), size)
+            )
+            self._spawn(member)
+
+    def _spawn(self, member):
+        member.process = self._context.Process(
+            target=run_captain,
+            args=(member.name, member.config_path, member.frames.name, self._statuses, self._stop,
+                  self.status_interval),
+            name=f'captain-{member.name}',
+            daemon=True
+        )
+        member.process.start()
+        member.started = time.monotonic()
+        member.restart_at = None
+        logger.info(f'Captain {member.name} started (pid {member.process.pid}) from {member.config_path}')
+
+    def run(self, report=None):
+        """ Start the fleet and supervise it until every captain has stopped, calling `report` with each status """
+        self.start()
+        try:
+            while any(member.running or member.restart_at is not None for member in self.members.values()):
+                self.poll(self.status_interval)
+                self.supervise()
+                self.save_snapshots()
+                if report is not None:
+                    report(self.status())
+        except KeyboardInterrupt:
+            logger.info('Stopping the fleet')
+        finally:
+            self.stop()
+
+    def poll(self, timeout):
+        """ Collect the reports the captains send over the next `timeout` seconds, keeping the latest of each """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status = self._statuses.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            member = self.members.get(status['name'])
+            if member is not None:
+                member.status = status
+
+    def supervise(self):
+        """ Note captains that exited and restart failed ones once their backoff has passed """
+        now = time.monotonic()
+        for member in self.members.values():
+            if member.restart_at is not None:
+                if now >= member.restart_at:
+                    member.restarts += 1
+                    self._spawn(member)
+                continue
+
+            if member.process is None or member.running:
+                continue
+
+            exitcode = member.process.exitcode
+            if exitcode == 0 or not self.restart or self._stop.is_set():
+                continue
+
+            uptime = now - member.started
+            member.failures = 1 if uptime >= HEALTHY_UPTIME else member.failures + 1
+            delay = min(RESTART_BACKOFF * 2 ** (member.failures - 1), RESTART_BACKOFF_MAX)
+            member.restart_at = now + delay
+            logger.warning(f'Captain {member.name} exited with {exitcode}, restarting in {delay:.0f}s')
+
+    def save_snapshots(self):
+        if not self.snapshot_dir:
+            return
+
+        from cv2 import cv2 as cv
+
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        for member in self.members.values():
+            frame = member.latest_frame()
+            if frame is not None:
+                cv.imwrite(str(self.snapshot_dir / f'{member.name}.png'), cv.cvtColor(frame, cv.COLOR_RGB2BGR))
+
+    def status(self) -> dict:
+        """ Per-captain status with the instrumentation of every captain merged under `metrics` """
+        merged = Instruments(enabled=True)
+        captains = {}
+        for name, member in self.members.items():
+            report = member.status
+            histograms = report.get('instruments', {}).get('histograms', {})
+            if report.get('instruments'):
+                merged.merge(report['instruments'])
+
+            if member.running:
+                state = 'running'
+            elif member.restart_at is not None:
+                state = 'restarting'
+            elif member.process is None:
+                state = 'pending'
+            else:
+                state = f'exited ({member.process.exitcode})'
+
+            captains[name] = {
+                'pid': member.process.pid if member.process is not None else None,
+                'state': state,
+                'restarts': member.restarts,
+                'uptime': time.monotonic() - member.started if member.running else 0.0,
+                'frames': _frames_acquired(member),
+                'looks': histograms.get('eyes.look', {}).get('total', 0),
+                'actions': sum(
+                    histogram['total'] for span, histogram in histograms.items() if span.startswith('action.')
+                ),
+                'queued': report.get('queued', 0),
+                'last_detection': report.get('last_detection'),
+                'reported': report.get('time')
+            }
+
+        return {'captains': captains, 'metrics': merged.snapshot()}
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """ Ask every captain to stop, terminate those that do not within `timeout`, and release the frame blocks """
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for member in self.members.values():
+            member.restart_at = None
+            if member.process is not None:
+                member.process.join(max(0.0, deadline - time.monotonic()))
+                if member.process.is_alive():
+                    logger.warning(f'Captain {member.name} did not stop, terminating it')
+                    member.process.terminate()
+                    member.process.join()
+
+        for member in self.members.values():
+            if member.frames is not None:
+                member.frames.close()
+                member.frames.unlink()
+                member.frames = None
+
+
+def _frames_acquired(member) -> int:
+    return SharedFramePool.frames_acquired(member.frames.buf) if member.frames is not None else 0
+
+
+def format_status(status) -> str:
+    """ Render Fleet.status() as a table of captains followed by the merged metrics """
+    from ..utils.instruments import format_snapshot
+
+    lines = [f'{"captain":<16} {"pid":>7} {"state":<12} {"uptime":>8} {"frames":>8} {"looks":>8} {"actions":>8} '
+             f'{"queued":>6}  last detection']
+    for name, captain in status['captains'].items():
+        lines.append(
+            f'{name:<16} {captain["pid"] or "-":>7} {captain["state"]:<12} {captain["uptime"]:>7.0f}s '
+            f'{captain["frames"]:>8} {captain["looks"]:>8} {captain["actions"]:>8} {captain["queued"]:>6}  '
+            f'{captain["last_detection"] or "-"}'
+        )
+    lines.append('')
+    lines.append(format_snapshot(status['metrics']))
+    return '\n'.join(lines)
+
+
+def get_fleet(captains=None, **kwargs):
+    """ Build a Fleet of the given captains (name: configuration file), by default those in [captains] """
+    return Fleet(captains or get_settings().fleet.captains, **kwargs)
+
+
+__all__ = ['Fleet', 'FleetMember', 'format_status', 'get_fleet', 'run_captain']
@@ -0,0 +1,116 @@
+import abc
+import collections
+import logging
+import time
+from ..utils.settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+InputEvent = collections.namedtuple('InputEvent', ('timestamp', 'kind', 'value'))
+
+
+class InputBackend(metaclass=abc.ABCMeta):
+    """ Abstract base class from which all keyboard/mouse input backends will be derived """
+
+    @abc.abstractmethod
+    def press_key(self, code):
+        """ Must be implemented in an InputBackend child, press the key with the given virtual key code """
+
+    @abc.abstractmethod
+    def release_key(self, code):
+        """ Must be implemented in an InputBackend child, release the key with the given virtual key code """
+
+    @abc.abstractmethod
+    def point_mouse(self, position):
+        """ Must be implemented in an InputBackend child, move the cursor to the given screen position """
+
+    @abc.abstractmethod
+    def press_mouse(self):
+        """ Must be implemented in an InputBackend child, press the left mouse button """
+
+    @abc.abstractmethod
+    def release_mouse(self):
+        """ Must be implemented in an InputBackend child, release the left mouse button """
+
+
+class Win32Backend(InputBackend):
+    """ Sends input to the desktop through the win32 API """
+
+    def __init__(self):
+        # Imported here so the rest of the package works where pywin32 is unavailable
+        import win32api
+        import win32con
+        self._api = win32api
+        self._con = win32con
+
+    def press_key(self, code):
+        self._api.keybd_event(code, 0, 0, 0)
+
+    def release_key(self, code):
+        self._api.keybd_event(code, 0, self._con.KEYEVENTF_KEYUP, 0)
+
+    def point_mouse(self, position):
+        self._api.SetCursorPos(position)
+
+    def press_mouse(self):
+        self._api.mouse_event(self._con.MOUSEEVENTF_LEFTDOWN, 0, 0)
+
+    def release_mouse(self):
+        self._api.mouse_event(self._con.MOUSEEVENTF_LEFTUP, 0, 0)
+
+
+class RecordingBackend(InputBackend):
+    """
+    Records input in memory instead of sending it anywhere
+
+    Each call appends an InputEvent stamped with `time.perf_counter()`, keeping the most recent `max_events`, so the
+    action layer can run headless and the delay between a decision and its input can be measured.
+    """
+
+    def __init__(self, max_events=10000):
+        self.events = collections.deque(maxlen=max_events)
+        self.held_keys = set()
+
+    def _record(self, kind, value=None):
+        self.events.append(InputEvent(time.perf_counter(), kind, value))
+
+    def press_key(self, code):
+        self.held_keys.add(code)
+        self._record('key_down', code)
+
+    def release_key(self, code):
+        self.held_keys.discard(code)
+        self._record('key_up', code)
+
+    def point_mouse(self, position):
+        self._record('mouse_move', tuple(position))
+
+    def press_mouse(self):
+        self._record('mouse_down')
+
+    def release_mouse(self):
+        self._record('mouse_up')
+
+    def clear(self):
+        self.events.clear()
+
+
+INPUT_BACKENDS = {
+    'win32': Win32Backend,
+    'recording': RecordingBackend
+}
+
+
+def get_input_backend(backend=None) -> InputBackend:
+    """ Build the input backend named by the [input] configuration section """
+
+    backend = backend or get_settings().input.backend
+    if backend not in INPUT_BACKENDS:
+        raise ValueError(f'Unknown input backend: {backend}')
+
+    logger.debug(f'Using the {backend} input backend')
+    return INPUT_BACKENDS[backend]()
+
+
+__all__ = ['InputBackend', 'InputEvent', 'Win32Backend', 'RecordingBackend', 'get_input_backend']
@@ -1,7 +1,11 @@
 import asyncio
 import logging
+import signal
 from queue import Empty
+from ..utils.instruments import instruments
+from ..utils.settings import get_settings
 from . import randomizer
+from .pipeline import Pipeline
 
 
 logger = logging.getLogger(__name__)
@@ -25,30 +29,46 @@ class AnimaLiaison:
 
     def dispatch(self):
         """ This is the application entry point where the `operate` coroutine is invoked """
+        if get_settings().instrumentation.enabled:
+            instruments.enabled = True
+            self.handle_dump_signal()
+
         try:
             asyncio.run(self.operate())
         except (KeyboardInterrupt, SystemExit):
             self.captain.kill()
             logger.debug('Exiting')
+        finally:
+            instruments.dump()
+
+    @staticmethod
+    def handle_dump_signal():
+        """ Dump the instrumentation on SIGUSR1 (Ctrl+Break on Windows) without stopping """
+        dump_signal = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+        if dump_signal is not None:
+            signal.signal(dump_signal, lambda signum, frame: instruments.dump())
 
     async def operate(self):
         """ Main logic loop """
 
+        if get_settings().pipeline.enabled:
+            await Pipeline(captain=self.captain).run()
+            return
+
         while self.captain.alive:
             if not self.captain.ready:
                 await self.captain.train()
 
-            await self.captain.update()
+            with instruments.span('liaison.tick'):
+                await self.captain.update()
 
-            self.captain.look()
+                self.captain.look()
 
-            try:
-                while True:
-                    result = await self.captain.perform_next_action()
-                    if result is not None:
-                        await result()
-            except Empty:
-                logger.debug(f'No more actions in queue')
+                try:
+                    while self.captain.alive:
+                        await self.captain.perform_next_action()
+                except Empty:
+                    logger.debug('No more actions in queue')
 
             # Wait a random amount before proceeding
             await asyncio.sleep(randomizer.random_wait())
@@ -0,0 +1,376 @@
+import logging
+import math
+import threading
+import time
+import numpy
+from cv2 import cv2 as cv
+from typing import Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class ColorMatcher:
+    """
+    Classifies pixels against a batch of trigger colors in a single pass over the frame
+
+    Each trigger's bounds are folded into a per-channel lookup table at learn time, where bit `n` of an entry is set
+    when the channel value falls inside trigger `n`'s range.  Looking up all three channels and AND-ing the results
+    classifies every pixel against every trigger at once.  The frame is processed in bands of rows so the scan can
+    stop as soon as every trigger has reached `min_pixels`, which makes the reported counts lower bounds.
+    """
+
+    max_triggers = 8
+
+    def __init__(self, variance=6, min_pixels=1, band_rows=64):
+        self.variance = variance
+        self.min_pixels = min_pixels
+        self.band_rows = band_rows
+        self._bounds = {}
+        self._lut = None
+        self._members = None
+        self._scratch = (numpy.empty(0, dtype=numpy.uint8), numpy.empty(0, dtype=numpy.uint8))
+
+    def __len__(self):
+        return len(self._bounds)
+
+    @property
+    def keys(self):
+        return list(self._bounds)
+
+    def bounds(self, key):
+        return self._bounds[key]
+
+    def learn(self, key, color):
+        if key not in self._bounds and len(self._bounds) >= self.max_triggers:
+            raise ValueError(f'A color matcher holds at most {self.max_triggers} triggers: {key}')
+
+        color = numpy.array(color, dtype=numpy.int16)
+        self._bounds[key] = (
+            numpy.clip(color - self.variance, 0, 255).astype(numpy.uint8),
+            numpy.clip(color + self.variance, 0, 255).astype(numpy.uint8)
+        )
+        self._lut = None
+
+    def forget(self, key):
+        if self._bounds.pop(key, None) is not None:
+            self._lut = None
+
+    def match(self, image) -> dict:
+        """ Return the pixel count of every trigger found at least `min_pixels` times in the RGB image """
+        if not self._bounds:
+            return {}
+
+        if self._lut is None:
+            self._compile()
+
+        height, width = image.shape[:2]
+        lookup, mask = self._buffers(width)
+        counts = numpy.zeros(len(self._bounds), dtype=numpy.int64)
+
+        for start in range(0, height, self.band_rows):
+            band = image[start:start + self.band_rows]
+            rows = band.shape[0]
+            cv.LUT(band, self._lut, dst=lookup[:rows])
+            numpy.bitwise_and(lookup[:rows, :, 0], lookup[:rows, :, 1], out=mask[:rows])
+            numpy.bitwise_and(mask[:rows], lookup[:rows, :, 2], out=mask[:rows])
+            counts += self._members @ numpy.bincount(mask[:rows].ravel(), minlength=256)
+
+            if (counts >= self.min_pixels).all():
+                break
+
+        return {key: int(count) for key, count in zip(self._bounds, counts) if count >= self.min_pixels}
+
+    def _compile(self):
+        lut = numpy.zeros((1, 256, 3), dtype=numpy.uint8)
+        for bit, (lower, upper) in enumerate(self._bounds.values()):
+            for channel in range(3):
+                lut[0, lower[channel]:int(upper[channel]) + 1, channel] |= 1 << bit
+
+        # Row n flags every classified pixel value which includes trigger n
+        combos = numpy.arange(256)
+        self._members = numpy.stack([(combos >> bit) & 1 for bit in range(len(self._bounds))])
+        self._lut = lut
+
+    def _buffers(self, width):
+        # Views over flat buffers sized for the widest image so far, so they stay contiguous as the width changes
+        lookup, mask = self._scratch
+        if mask.size < self.band_rows * width:
+            lookup, mask = self._scratch = (
+                numpy.empty(self.band_rows * width * 3, dtype=numpy.uint8),
+                numpy.empty(self.band_rows * width, dtype=numpy.uint8)
+            )
+        return (lookup[:self.band_rows * width * 3].reshape(self.band_rows, width, 3),
+                mask[:self.band_rows * width].reshape(self.band_rows, width))
+
+
+class FramePyramid:
+    """ Lazily downscaled copies of a grayscale frame, reusing the same buffers from one frame to the next """
+
+    def __init__(self):
+        self.frame = None
+        self._levels = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def update(self, frame):
+        self.frame = frame
+        self._levels = {}
+
+    def size(self, scale):
+        height, width = self.frame.shape[:2]
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def level(self, scale):
+        if scale == 1.0:
+            return self.frame
+
+        # Templates matched on worker threads may ask for the same level at once; only one of them builds it
+        with self._lock:
+            level = self._levels.get(scale)
+            if level is None:
+                size = self.size(scale)
+                buffer = self._buffers.get(scale)
+                if buffer is None or buffer.shape[::-1] != size:
+                    buffer = self._buffers[scale] = numpy.empty(size[::-1], dtype=self.frame.dtype)
+                level = self._levels[scale] = cv.resize(self.frame, size, dst=buffer, interpolation=cv.INTER_AREA)
+
+        return level
+
+
+class TemplateMatcher:
+    """
+    Coarse-to-fine normalized template matching
+
+    The template is pre-scaled into a pyramid at learn time.  A frame is searched exhaustively at the coarsest usable
+    scale only; up to `max_candidates` peaks above `coarse_threshold` are then refined through each finer level by
+    matching in a small window around the projected location, finishing at full resolution.  Scales at which the
+    template would shrink below `min_template_size` pixels are skipped, and with no usable scales the frame is
+    matched at full resolution directly.  `timings` holds the seconds spent at each scale during the last match,
+    including any downscaling of the frame it triggered.
+
+    A pyramid built earlier (see `levels`) may be passed as `levels` in place of `scales` to skip the downscaling.
+    """
+
+    min_template_size = 8
+
+    def __init__(self, template, scales=(), threshold=0.75, coarse_threshold=None, max_candidates=3, levels=None):
+        self.template = template
+        self.threshold = threshold
+        self.coarse_threshold = threshold - 0.15 if coarse_threshold is None else coarse_threshold
+        self.max_candidates = max_candidates
+        self.timings = {}
+
+        if levels is not None:
+            self._pyramid = dict(levels)
+            return
+
+        self._pyramid = {1.0: template}
+        height, width = template.shape[:2]
+        for scale in scales:
+            if not 0 < scale < 1:
+                raise ValueError(f'Template scales must be between 0 and 1: {scale}')
+
+            size = (int(width * scale), int(height * scale))
+            if min(size) >= self.min_template_size:
+                self._pyramid[scale] = cv.resize(template, size, interpolation=cv.INTER_AREA)
+
+    @property
+    def scales(self):
+        return sorted(self._pyramid)
+
+    @property
+    def levels(self):
+        """ The template at each scale it is matched at, including 1.0 """
+        return dict(self._pyramid)
+
+    def match(self, frames: FramePyramid) -> Tuple[float, Optional[Tuple[int, int]]]:
+        """ Return the best score found and its top-left location in the full resolution frame """
+        self.timings = {}
+        scales = [scale for scale in self.scales if self._fits(frames, scale)]
+        if not scales:
+            return -1.0, None
+
+        coarse = scales[0]
+        started = time.perf_counter()
+        result = cv.matchTemplate(frames.level(coarse), self._pyramid[coarse], cv.TM_CCOEFF_NORMED)
+
+        if coarse == 1.0:
+            _, score, _, location = cv.minMaxLoc(result)
+            self.timings[coarse] = time.perf_counter() - started
+            return score, location
+
+        candidates = self._candidates(result, coarse)
+        self.timings[coarse] = time.perf_counter() - started
+
+        best_score, best_location = -1.0, None
+        for location in candidates:
+            score, location = self._refine(frames, location, scales)
+            if score > best_score:
+                best_score, best_location = score, location
+            if score >= self.threshold:
+                break
+
+        return best_score, best_location
+
+    def match_window(self, frame, window) -> Tuple[float, Optional[Tuple[int, int]]]:
+        """ Match at full resolution within a (left, top, right, bottom) window of the frame only """
+        started = time.perf_counter()
+        template = self._pyramid[1.0]
+        left, top, right, bottom = window
+        area = frame[top:bottom, left:right]
+        if area.shape[0] < template.shape[0] or area.shape[1] < template.shape[1]:
+            return -1.0, None
+
+        _, score, _, (x, y) = cv.minMaxLoc(cv.matchTemplate(area, template, cv.TM_CCOEFF_NORMED))
+        self.timings = {1.0: time.perf_counter() - started}
+        return score, (left + x, top + y)
+
+    def _fits(self, frames, scale):
+        height, width = self._pyramid[scale].shape[:2]
+        frame_width, frame_height = frames.size(scale)
+        return frame_width >= width and frame_height >= height
+
+    def _candidates(self, result, scale):
+        height, width = self._pyramid[scale].shape[:2]
+        candidates = []
+
+        while len(candidates) < self.max_candidates:
+            _, score, _, (x, y) = cv.minMaxLoc(result)
+            if score < self.coarse_threshold:
+                break
+
+            candidates.append((x, y))
+            # Suppress the neighbourhood of this peak so the next candidate is a distinct location
+            result[max(0, y - height // 2):y + height // 2 + 1, max(0, x - width // 2):x + width // 2 + 1] = -1.0
+
+        return candidates
+
+    def _refine(self, frames, location, scales):
+        x, y = location
+        previous = scales[0]
+        score = -1.0
+
+        for scale in scales[1:]:
+            started = time.perf_counter()
+            ratio = scale / previous
+            template = self._pyramid[scale]
+            height, width = template.shape[:2]
+            frame = frames.level(scale)
+            pad = int(math.ceil(ratio)) + 2
+
+            left, top = max(0, int(x * ratio) - pad), max(0, int(y * ratio) - pad)
+            window = frame[top:int(y * ratio) + height + pad, left:int(x * ratio) + width + pad]
+            if window.shape[0] < height or window.shape[1] < width:
+                return -1.0, None
+
+            _, score, _, (dx, dy) = cv.minMaxLoc(cv.matchTemplate(window, template, cv.TM_CCOEFF_NORMED))
+            x, y = left + dx, top + dy
+            previous = scale
+            self.timings[scale] = self.timings.get(scale, 0.0) + time.perf_counter() - started
+
+        return score, (x, y)
+
+
+class ChangeDetector:
+    """
+    Decides whether a frame differs enough from the last analyzed frame to be worth running the detectors again
+
+    Frames are reduced to a small grayscale thumbnail, each cell holding the mean of a block of pixels, and compared
+    to the thumbnail of the last frame reported as changed.  The largest per-cell difference, in gray levels, is
+    checked against `threshold` so that a small prompt appearing in a large static field still registers.  Comparing
+    against the last changed frame rather than the previous one keeps a slow drift from going unnoticed.  `hits`
+    counts frames reported unchanged, `misses` changed ones.
+    """
+
+    def __init__(self, threshold=4.0, size=64):
+        self.threshold = threshold
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._thumbnail = numpy.empty((size, size), dtype=numpy.uint8)
+        self._delta = numpy.empty((size, size), dtype=numpy.uint8)
+        self._reference = None
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def changed(self, frame) -> bool:
+        cv.resize(frame, (self.size, self.size), dst=self._thumbnail, interpolation=cv.INTER_AREA)
+
+        if self._reference is not None:
+            cv.absdiff(self._thumbnail, self._reference, dst=self._delta)
+            if self._delta.max() < self.threshold:
+                self.hits += 1
+                return False
+
+        # Keep this thumbnail as the new reference and recycle the old one for the next frame
+        if self._reference is None:
+            self._reference = numpy.empty_like(self._thumbnail)
+        self._thumbnail, self._reference = self._reference, self._thumbnail
+        self.misses += 1
+        return True
+
+    def reset(self):
+        self._reference = None
+
+
+class Tracker:
+    """
+    Remembers where each detector last found its target, so the next look can verify it there before searching
+
+    Tracks are (left, top, right, bottom) bboxes in the coordinates of the frame the detector searched.  `window`
+    pads a track by `padding` pixels for the verification; a track which fails verification is dropped, and one
+    verified `max_age` frames in a row expires, so a full search regularly confirms the target has not moved
+    elsewhere.  `hits` counts successful verifications, `misses` failed ones.
+    """
+
+    def __init__(self, padding=24, max_age=30):
+        self.padding = padding
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._tracks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def window(self, key, shape) -> Optional[Tuple[int, int, int, int]]:
+        """ The padded bbox to verify `key` in, clipped to a frame of `shape`, None when it is not tracked """
+        track = self._tracks.get(key)
+        if track is None:
+            return None
+
+        (left, top, right, bottom), age = track
+        if age >= self.max_age:
+            del self._tracks[key]
+            return None
+
+        height, width = shape[:2]
+        return (max(0, left - self.padding), max(0, top - self.padding),
+                min(width, right + self.padding), min(height, bottom + self.padding))
+
+    def hit(self, key, bbox):
+        with self._lock:
+            self.hits += 1
+            self._tracks[key] = (bbox, self._tracks[key][1] + 1 if key in self._tracks else 1)
+
+    def miss(self, key):
+        with self._lock:
+            self.misses += 1
+            self._tracks.pop(key, None)
+
+    def update(self, key, bbox):
+        """ Start tracking `key` from a full search """
+        self._tracks[key] = (bbox, 0)
+
+    def forget(self):
+        self._tracks = {}
+
+
+__all__ = ['ColorMatcher', 'FramePyramid', 'TemplateMatcher', 'ChangeDetector', 'Tracker']
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from ..utils.settings import get_settings
+from ..utils.instruments import instruments
+from .actions import Look
+from .capture import FramePool
+
+
+logger = logging.getLogger(__name__)
+
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# Passed down the stages once capture stops, since None is a valid detection result
+FINISHED = object()
+
+
+class StageStats:
+    """ Throughput counters for a single pipeline stage """
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.max_depth = 0
+
+    def report(self, elapsed, queue=None) -> dict:
+        return {
+            'processed': self.processed,
+            'per_second': self.processed / elapsed if elapsed else 0.0,
+            'busy': self.busy / elapsed if elapsed else 0.0,
+            'dropped': self.dropped,
+            'queue_depth': queue.qsize() if queue is not None else 0,
+            'max_queue_depth': self.max_depth
+        }
+
+
+class Pipeline:
+    """
+    Staged replacement for the serial look/act loop
+
+    A capture stage grabs samples, a detection stage examines them and an action stage reacts to the results and
+    executes the queued actions.  The stages are connected by bounded asyncio queues; capture and detection run their
+    blocking work on their own threads while actions await on the loop, so the next frame is grabbed while the
+    previous one is examined and actions are executing.
+    When a queue is full the drop policy either discards the oldest item (`drop_oldest`, keeping results fresh),
+    discards the incoming item (`drop_newest`) or makes the producer wait (`block`).
+
+    When the eyes use a frame pool, the pipeline keeps its own pool large enough for every sample in flight (one being
+    captured, one being examined and `queue_size` waiting) and hands buffers back as samples are examined or dropped,
+    so a buffer is never overwritten while another stage still reads it.
+    """
+
+    def __init__(self, captain, queue_size=None, drop_policy=None, capture_interval=None, report_interval=None):
+        settings = get_settings().pipeline
+        queue_size = settings.queue_size if queue_size is None else queue_size
+        drop_policy = drop_policy or settings.drop_policy
+        capture_interval = settings.capture_interval if capture_interval is None else capture_interval
+        report_interval = settings.report_interval if report_interval is None else report_interval
+
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f'Unknown drop policy: {drop_policy}')
+
+        self.captain = captain
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.capture_interval = capture_interval
+        self.report_interval = report_interval
+        self.stats = {name: StageStats(name) for name in ('capture', 'detect', 'act')}
+        self._samples = None
+        self._results = None
+        self._free = None
+        self._started = None
+        self._executors = {}
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        queues = {'capture': self._samples, 'detect': self._results}
+        return {name: stats.report(elapsed, queues.get(name)) for name, stats in self.stats.items()}
+
+    async def run(self):
+        if not self.captain.ready:
+            await self.captain.train()
+
+        eyes = self.captain.eyes
+        if eyes.pool is not None:
+            pool = FramePool(max(eyes.pool.size, self.queue_size + 2))
+            pool.allocate(eyes.source.frame_shape(eyes.capture_field))
+            self._free = asyncio.Queue()
+            for buffers in pool.buffers:
+                self._free.put_nowait(buffers)
+
+        self._samples = asyncio.Queue(maxsize=self.queue_size)
+        self._results = asyncio.Queue(maxsize=self.queue_size)
+        self._executors = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+                           for name in ('capture', 'detect')}
+        self._started = time.perf_counter()
+
+        stages = [asyncio.ensure_future(stage()) for stage in (self._capture, self._detect, self._act)]
+        if self.report_interval:
+            stages.append(asyncio.ensure_future(self._report()))
+
+        act = stages[2]
+        pending, failed = set(stages), []
+        try:
+            # Capture and detection finish first when a replay runs out; the pipeline lasts until actions stop
+            while act in pending and not failed:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                failed = [task for task in done if task.exception() is not None]
+        finally:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+
+            for executor in self._executors.values():
+                executor.shutdown(wait=False)
+            logger.info(f'Pipeline stats: {self.report()}')
+
+        # Surface the error of a stage which failed rather than stopping quietly
+        for task in failed:
+            task.result()
+
+    async def _capture(self):
+        loop = asyncio.get_running_loop()
+        stats = self.stats['capture']
+
+        while self.captain.alive:
+            buffers = await self._free.get() if self._free is not None else None
+            started = time.perf_counter()
+            try:
+                sample = await loop.run_in_executor(self._executors['capture'], self.captain.eyes.capture, None,
+                                                    buffers)
+            except EOFError:
+                logger.info('Capture source exhausted')
+                break
+
+            self._tally(stats, started)
+            await self._offer(self._samples, (sample, buffers), stats)
+            await asyncio.sleep(self.capture_interval)
+
+        await self._samples.put(FINISHED)
+
+    async def _detect(self):
+        loop = asyncio.get_running_loop()
+        stats = self.stats['detect']
+        eyes = self.captain.eyes
+
+        while self.captain.alive:
+            item = await self._samples.get()
+            if item is FINISHED:
+                break
+
+            sample, buffers = item
+            started = time.perf_counter()
+
+            try:
+                if eyes.parallel:
+                    result = await eyes.examine_async(sample)
+                else:
+                    result = await loop.run_in_executor(self._executors['detect'], eyes.examine, sample)
+            finally:
+                self._recycle(buffers)
+
+            self._tally(stats, started)
+            await self._offer(self._results, result, stats)
+
+        await self._results.put(FINISHED)
+
+    async def _act(self):
+        stats = self.stats['act']
+
+        while self.captain.alive:
+            result = await self._results.get()
+            if result is FINISHED:
+                self.captain.kill()
+                break
+
+            started = time.perf_counter()
+
+            await self.captain.update()
+            self.captain.action(Look).react(result)
+
+            # Actions await their waits on the loop, so capture and detection carry on while they run
+            while self.captain.alive:
+                try:
+                    await self.captain.perform_next_action(timeout=0)
+                except Empty:
+                    break
+
+            self._tally(stats, started)
+
+    @staticmethod
+    def _tally(stats, started):
+        elapsed = time.perf_counter() - started
+        stats.processed += 1
+        stats.busy += elapsed
+        instruments.record(f'pipeline.{stats.name}', elapsed)
+
+    async def _report(self):
+        while self.captain.alive:
+            await asyncio.sleep(self.report_interval)
+            logger.info(f'Pipeline stats: {self.report()}')
+
+    async def _offer(self, queue, item, stats):
+        if queue.full():
+            if self.drop_policy == 'drop_newest':
+                self._discard(queue, item)
+                stats.dropped += 1
+                return
+
+            if self.drop_policy == 'drop_oldest':
+                self._discard(queue, queue.get_nowait())
+                stats.dropped += 1
+
+        await queue.put(item)
+        stats.max_depth = max(stats.max_depth, queue.qsize())
+
+    def _discard(self, queue, item):
+        # Dropped samples hand their buffers back; dropped detection results need no cleanup
+        if queue is self._samples:
+            self._recycle(item[1])
+
+    def _recycle(self, buffers):
+        if buffers is not None:
+            self._free.put_nowait(buffers)
+
+
+__all__ = ['Pipeline', 'StageStats']
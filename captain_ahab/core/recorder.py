@@ -0,0 +1,136 @@
+import logging
+import os
+import pathlib
+import queue
+import threading
+import numpy
+from cv2 import cv2 as cv
+from ..utils.instruments import instruments
+from ..utils.settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+RECORDING_MODES = ('off', 'every', 'detections')
+RECORDING_FORMATS = ('jpg', 'png', 'npy')
+
+
+class FrameRecorder:
+    """
+    Saves sampled frames for debugging on a background thread
+
+    In `every` mode one frame in `every` is kept; in `detections` mode only frames in which something was found are.
+    A kept frame is copied (the capture buffers are reused) and queued for the writer thread, which encodes it as
+    `frame-NNNN.<format>` in `directory`.  File numbers wrap after `ring_size`, so the directory holds a rolling window
+    of the most recent frames.  When the writer falls behind and `queue_size` frames are waiting, new frames are
+    dropped rather than delaying the caller.
+
+    `npy` skips encoding entirely; `jpg` (at `jpeg_quality`) and `png` (at `png_compression`, 0-9) are smaller but
+    cost more of the writer's time.
+    """
+
+    def __init__(self, directory, mode='every', every=1, ring_size=100, image_format='jpg', jpeg_quality=80,
+                 png_compression=1, queue_size=4):
+        if mode not in RECORDING_MODES:
+            raise ValueError(f'Unknown recording mode: {mode}')
+        if image_format not in RECORDING_FORMATS:
+            raise ValueError(f'Unknown recording format: {image_format}')
+
+        self.directory = pathlib.Path(directory)
+        self.mode = mode
+        self.every = max(1, every)
+        self.ring_size = max(1, ring_size)
+        self.image_format = image_format
+        self.recorded = 0
+        self.dropped = 0
+        self._seen = 0
+
+        if image_format == 'jpg':
+            self._parameters = [cv.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        elif image_format == 'png':
+            self._parameters = [cv.IMWRITE_PNG_COMPRESSION, png_compression]
+        else:
+            self._parameters = []
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+
+    def record(self, frame, found=None):
+        """ Offer an RGB frame and what was found in it, returning without waiting for it to be written """
+        if self.mode == 'off':
+            return
+
+        self._seen += 1
+        if self.mode == 'every' and (self._seen - 1) % self.every:
+            return
+        if self.mode == 'detections' and found is None:
+            return
+
+        if self._writer is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_frames, name='recorder', daemon=True)
+            self._writer.start()
+
+        try:
+            self._queue.put_nowait(frame.copy())
+        except queue.Full:
+            self.dropped += 1
+            instruments.count('recorder.dropped')
+
+    def close(self, timeout=5.0):
+        """ Write out the frames still queued and stop the writer thread """
+        if self._writer is None:
+            return
+
+        self._queue.put(None)
+        self._writer.join(timeout)
+        self._writer = None
+
+    def _write_frames(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+
+            try:
+                with instruments.span('recorder.write'):
+                    self._write(frame)
+            except Exception:
+                logger.exception('Unable to save a recorded frame')
+
+    def _write(self, frame):
+        path = self.directory / f'frame-{self.recorded % self.ring_size:04d}.{self.image_format}'
+        # Encoded beside the final name then renamed, so a viewer never opens a partly written frame
+        staging = path.with_name(f'.{path.stem}.tmp.{self.image_format}')
+
+        if self.image_format == 'npy':
+            with open(staging, 'wb') as stream:
+                numpy.save(stream, frame)
+        elif not cv.imwrite(str(staging), cv.cvtColor(frame, cv.COLOR_RGB2BGR), self._parameters):
+            raise ValueError(f'Unable to encode {staging}')
+
+        os.replace(str(staging), str(path))
+        self.recorded += 1
+
+
+def get_frame_recorder(mode=None):
+    """ Build a FrameRecorder from the [recording] configuration section, None when recording is off """
+
+    settings = get_settings().recording
+    mode = mode or settings.mode
+    if mode == 'off':
+        return None
+
+    return FrameRecorder(
+        settings.directory,
+        mode=mode,
+        every=settings.every,
+        ring_size=settings.ring_size,
+        image_format=settings.image_format,
+        jpeg_quality=settings.jpeg_quality,
+        png_compression=settings.png_compression,
+        queue_size=settings.queue_size
+    )
+
+
+__all__ = ['FrameRecorder', 'get_frame_recorder']
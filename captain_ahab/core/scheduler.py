@@ -0,0 +1,131 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from queue import Empty
+from ..utils.instruments import instruments
+from .actions import PrioritizedAction
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActionScheduler:
+    """
+    asyncio-native priority queue of actions awaiting execution
+
+    Lower priorities run first and actions sharing a priority run in the order they were queued.  `get` can be awaited
+    with a timeout (raising queue.Empty, as the thread-safe queue it replaces did) and cancelled without losing an
+    action.  The scheduler is not thread-safe: actions must be queued from the event loop's thread.
+
+    An action queued while another of the same class is still pending at the same priority is merged into it (see
+    `put`), so a burst of identical requests runs once.  The PrioritizedAction records are pooled: callers hand them
+    back with `recycle` once the action has run, and up to `pool_size` are kept for reuse.
+    """
+
+    def __init__(self, pool_size=64):
+        self.pool_size = pool_size
+        self.merged = 0
+        self._heap = []
+        self._pending = {}
+        self._free = []
+        self._sequence = itertools.count()
+        self._available = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def qsize(self):
+        return len(self._heap)
+
+    def empty(self):
+        return not self._heap
+
+    def put(self, action, priority, merge=True) -> PrioritizedAction:
+        """ Queue an action, returning the pending item it was merged into instead when `merge` finds one """
+        key = (action.__class__, priority)
+        if merge:
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.merged += 1
+                instruments.count('scheduler.merged')
+                return pending
+
+        queued_item = self._free.pop() if self._free else PrioritizedAction()
+        queued_item.priority = priority
+        queued_item.action = action
+        queued_item.sequence = next(self._sequence)
+        heapq.heappush(self._heap, queued_item)
+        self._pending.setdefault(key, queued_item)
+
+        if self._available is not None:
+            self._available.set()
+
+        return queued_item
+
+    def get_nowait(self) -> PrioritizedAction:
+        if not self._heap:
+            raise Empty
+
+        return self._pop()
+
+    async def get(self, timeout=None) -> PrioritizedAction:
+        # The event is created lazily so it belongs to the loop that first waits on it
+        if self._available is None:
+            self._available = asyncio.Event()
+
+        while not self._heap:
+            if timeout == 0:
+                raise Empty
+
+            self._available.clear()
+            try:
+                await asyncio.wait_for(self._available.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise Empty from None
+
+        return self._pop()
+
+    def _pop(self) -> PrioritizedAction:
+        queued_item = heapq.heappop(self._heap)
+        # Once taken the action is no longer pending, so the same action queued from now on runs again
+        key = (queued_item.action.__class__, queued_item.priority)
+        if self._pending.get(key) is queued_item:
+            del self._pending[key]
+        return queued_item
+
+    def recycle(self, queued_item):
+        """ Return a record taken from the scheduler once its action has run, for reuse by a later `put` """
+        if len(self._free) < self.pool_size:
+            queued_item.action = None
+            self._free.append(queued_item)
+
+    def cancel(self, action_cls) -> int:
+        """ Remove every queued action of the given class, returning how many were removed """
+        remaining = [queued_item for queued_item in self._heap if not isinstance(queued_item.action, action_cls)]
+        cancelled = len(self._heap) - len(remaining)
+
+        if cancelled:
+            for queued_item in self._heap:
+                if isinstance(queued_item.action, action_cls):
+                    self.recycle(queued_item)
+            heapq.heapify(remaining)
+            self._heap = remaining
+            self._pending = {
+                key: queued_item for key, queued_item in self._pending.items()
+                if not issubclass(key[0], action_cls)
+            }
+
+        return cancelled
+
+    def purge(self) -> int:
+        """ Remove every queued action, returning how many were removed """
+        purged = len(self._heap)
+        for queued_item in self._heap:
+            self.recycle(queued_item)
+        self._heap = []
+        self._pending = {}
+        return purged
+
+
+__all__ = ['ActionScheduler']
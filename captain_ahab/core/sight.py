@@ -1,16 +1,58 @@
+import asyncio
 import logging
-from numpy import array
-from PIL import ImageGrab
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from numpy import ndarray
 from cv2 import cv2 as cv
-from typing import Union, Set
-from ..utils.constants import ImageRegistry, TriggerColors, VERBOSITY, SAMPLE_PATH
+from typing import Optional, Union, Set, Tuple
+from ..utils.constants import ImageRegistry, TriggerColors
+from ..utils.settings import get_settings
+from ..utils.instruments import instruments
+from .capture import ImageGrabSource
+from .matchers import ColorMatcher, FramePyramid, TemplateMatcher, ChangeDetector, Tracker
 
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class Detection:
+    """ A learned image located in the visual field, with its bbox in screen coordinates """
+    target: ImageRegistry
+    score: float
+    bbox: Tuple[int, int, int, int]
+    timestamp: float = field(default_factory=time.time)
+
+    def __str__(self):
+        return f'{self.target.name}({self.score:.2f}) at {self.bbox}'
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        left, top, right, bottom = self.bbox
+        return (left + right) // 2, (top + bottom) // 2
+
+
+@dataclass(frozen=True)
+class Sample:
+    """ A captured frame: color and grayscale pixels, the screen bbox they cover and the detector region origin """
+    color: ndarray
+    gray: ndarray
+    bbox: Tuple[int, int, int, int]
+    origin: Optional[Tuple[int, int]]
+    timestamp: float = field(default_factory=time.time)
+
+
 class Eyes:
-    def __init__(self, x, y, width, height):
+    def __init__(self, x, y, width, height, source=None, pool=None, change_threshold=None, workers=None,
+                 template_cache=None, recorder=None, track_padding=None, track_frames=None):
+        settings = get_settings().vision
+        change_threshold = settings.change_threshold if change_threshold is None else change_threshold
+        workers = settings.detector_workers if workers is None else workers
+        track_padding = settings.track_padding if track_padding is None else track_padding
+        track_frames = settings.track_frames if track_frames is None else track_frames
+
         self._x = x
         self._y = y
         self._w = width
@@ -19,71 +61,479 @@ class Eyes:
         self._current_view_bw = None
         self._known_images = {}
         self._known_triggers = {}
+        self._image_regions = {}
+        self._trigger_regions = {}
+        self._capture_region = None
+        self._view_origin = None
+        self._sampled_field = None
+        self._last_detection = None
+        self._last_result = None
+        self._change_detector = ChangeDetector(threshold=change_threshold) if change_threshold else None
+        self._tracker = Tracker(padding=track_padding, max_age=track_frames) if track_padding else None
+        self._color_matchers = {}
+        self._focus = (None, None)
+        self._pending_focus = None
+        self._focus_lock = threading.Lock()
+        self._focused = None
+        self._focused_color_matchers = {}
+        self._trigger_counts = {}
+        self._pyramids = {}
         self._variance = 6
+        self._source = source or ImageGrabSource()
+        self._pool = pool
+        self._template_cache = template_cache
+        self._recorder = recorder
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='eyes') if workers else None
 
     @property
     def visual_field(self):
         return self._x, self._y, self._w, self._h
 
-    def sample(self, target_field=None):
-        # Sample the field of vision
-        image = ImageGrab.grab(bbox=target_field or self.visual_field)
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def parallel(self):
+        """ True when detectors run on a worker pool through look_async """
+        return self._executor is not None
+
+    @property
+    def last_detection(self):
+        """ The most recent Detection returned by look, which may be from an earlier frame """
+        return self._last_detection
+
+    @property
+    def change_detector(self):
+        """ The ChangeDetector deciding when a look can reuse the last result, None when disabled """
+        return self._change_detector
+
+    @property
+    def tracker(self):
+        """ The Tracker verifying detections near where they were last found first, None when disabled """
+        return self._tracker
+
+    @property
+    def trigger_counts(self):
+        """ Matched pixel counts for the triggers found by the last look """
+        return self._trigger_counts
 
-        # Save a copy of the image for debugging if the configuration has a path set
-        if SAMPLE_PATH:
-            image.save(SAMPLE_PATH)
+    @property
+    def focused(self):
+        """ The (image keys, trigger keys) each look is limited to, None for every learned detector of a kind """
+        return self._pending_focus or self._focus
+
+    @property
+    def template_timings(self):
+        """ Seconds spent at each pyramid scale per image during the last look """
+        return {image_key: matcher.timings for image_key, matcher in self._known_images.items()}
+
+    @property
+    def capture_field(self):
+        """ The screen bbox sampled each look: the union of detector regions when every detector has one """
+        if self._capture_region is None:
+            return self.visual_field
+
+        left, top, right, bottom = self._capture_region
+        return self._x + left, self._y + top, self._x + right, self._y + bottom
+
+    def capture(self, target_field=None, buffers=None) -> Sample:
+        """
+        Grab a Sample without touching the current view, so it can run while another sample is examined
+
+        A (color, grayscale) buffer pair may be given to capture into instead of the next buffers from the pool.
+        """
+        with instruments.span('eyes.sample'):
+            return self._capture(target_field, buffers)
+
+    def _capture(self, target_field, buffers) -> Sample:
+        if target_field is None:
+            field = self.capture_field
+            origin = (self._capture_region or (0, 0))[:2]
+        else:
+            # Detector regions are relative to the visual field and cannot be applied to an arbitrary field
+            field = target_field
+            origin = None
+
+        # Sample the field of vision, into preallocated buffers when a pool is available
+        if buffers is None and self._pool is not None:
+            buffers = self._pool.acquire(self._source.frame_shape(field))
+
+        if buffers is None:
+            color = self._source.grab(bbox=field)
+            gray = None
+        else:
+            color, gray = buffers
+            color = self._source.grab_into(field, color)
 
-        self._current_view = array(image)
         # Convert color for match
-        self._current_view_bw = cv.cvtColor(self._current_view, cv.COLOR_BGR2GRAY)
+        gray = cv.cvtColor(color, cv.COLOR_BGR2GRAY, dst=gray)
+        return Sample(color=color, gray=gray, bbox=field, origin=origin)
+
+    def sample(self, target_field=None):
+        self._view(self.capture(target_field=target_field))
+
+    def look(self, target_field=None) -> Union[Detection, Set[TriggerColors], None]:
+        with instruments.span('eyes.look'):
+            return self.examine(self.capture(target_field=target_field))
+
+    def examine(self, sample: Sample) -> Union[Detection, Set[TriggerColors], None]:
+        """ Run the detectors against a captured Sample """
+        self._apply_focus()
+        self._view(sample)
+
+        if not self._unchanged():
+            with instruments.span('eyes.detect'):
+                self._last_result = self._detect()
+
+        self._record(sample)
+        return self._last_result
+
+    async def look_async(self, target_field=None) -> Union[Detection, Set[TriggerColors], None]:
+        """ Look without blocking the event loop, running each detector on the worker pool when one is configured """
+        if self._executor is None:
+            return self.look(target_field=target_field)
+
+        with instruments.span('eyes.look'):
+            loop = asyncio.get_running_loop()
+            sample = await loop.run_in_executor(self._executor, self.capture, target_field)
+            return await self.examine_async(sample)
+
+    async def examine_async(self, sample: Sample) -> Union[Detection, Set[TriggerColors], None]:
+        if self._executor is None:
+            return self.examine(sample)
+
+        self._apply_focus()
+        self._view(sample)
+
+        if not self._unchanged():
+            with instruments.span('eyes.detect'):
+                self._last_result = await self._detect_parallel()
 
-    def look(self, target_field=None) -> Union[ImageRegistry, Set[TriggerColors], None]:
-        self.sample(target_field=target_field)
+        self._record(sample)
+        return self._last_result
 
-        if VERBOSITY >= 2:
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self._recorder is not None:
+            self._recorder.close()
+        self._source.close()
+
+    def _record(self, sample):
+        # Debugging captures are handed to the recorder's own thread so they never hold up the next look
+        if self._recorder is not None:
+            self._recorder.record(sample.color, self._last_result)
+
+    def _view(self, sample):
+        self._current_view = sample.color
+        self._current_view_bw = sample.gray
+        self._sampled_field = sample.bbox
+        self._view_origin = sample.origin
+
+    def _unchanged(self):
+        if self._change_detector is None:
+            return False
+
+        if self._view_origin is None:
+            # The reference frame only describes the usual capture field
+            self._change_detector.reset()
+            return False
+
+        if self._change_detector.changed(self._current_view_bw):
+            return False
+
+        instruments.count('eyes.unchanged')
+        if get_settings().captain.verbosity >= 3:
+            logger.debug('Sample unchanged, reusing the last result')
+        return True
+
+    def focus(self, images=None, triggers=None):
+        """
+        Limit each look to the given image and trigger keys, None for every learned detector of that kind
+
+        Keys which have not been learned are ignored.  Only the detectors change: the capture field stays the same, so
+        frame buffers and the change detector's reference frame remain valid across focus changes.  In the pipeline
+        focus is requested from the event loop while another thread examines samples, so the new focus only takes
+        effect when the next sample is examined.
+        """
+        focus = (None if images is None else frozenset(images), None if triggers is None else frozenset(triggers))
+        with self._focus_lock:
+            self._pending_focus = focus
+
+    def _apply_focus(self):
+        with self._focus_lock:
+            focus, self._pending_focus = self._pending_focus, None
+
+        if focus is None or focus == self._focus:
+            return
+
+        self._focus = focus
+        self._forget_result()
+        if get_settings().captain.verbosity >= 3:
+            logger.debug('Focused on images %s and triggers %s', *focus)
+
+    def _detectors(self):
+        # The focused subset of the image matchers and trigger color matchers, rebuilt only when either changes
+        if self._focused is None:
+            images, triggers = self._focus
+            self._focused = (
+                {key: matcher for key, matcher in self._known_images.items() if images is None or key in images},
+                self._color_matchers if triggers is None else self._focused_triggers(triggers)
+            )
+        return self._focused
+
+    def _focused_triggers(self, triggers) -> dict:
+        # Color matchers are compiled for a fixed set of triggers, so each subset gets its own (kept for reuse)
+        matchers = self._focused_color_matchers.get(triggers)
+        if matchers is None:
+            matchers = {}
+            for region, matcher in self._color_matchers.items():
+                keys = [key for key in matcher.keys if key in triggers]
+                if len(keys) == len(matcher):
+                    matchers[region] = matcher
+                elif keys:
+                    matchers[region] = ColorMatcher(variance=matcher.variance, min_pixels=matcher.min_pixels)
+                    for key in keys:
+                        matchers[region].learn(key, self._known_triggers[key])
+            self._focused_color_matchers[triggers] = matchers
+        return matchers
+
+    def _detect(self) -> Union[Detection, Set[TriggerColors], None]:
+        if get_settings().captain.verbosity >= 2:
             logger.debug('Checking for known images in the sample')
 
-        for image_key, image in self._known_images.items():
-            found = cv.matchTemplate(self._current_view_bw, image, cv.TM_CCOEFF_NORMED)
-            if (found >= 0.75).any():
-                return ImageRegistry[image_key]
+        images, color_matchers = self._detectors()
+        self._prepare_pyramids(images)
+        for image_key, matcher in images.items():
+            detection = self._match_image(image_key, matcher)
+            if detection is not None:
+                self._last_detection = detection
+                return detection
 
-        if VERBOSITY >= 2:
+        if get_settings().captain.verbosity >= 2:
             logger.debug('Checking for pixels matching known triggers in the sample')
 
-        matched_pixels = set()
-        for trigger_key, trigger in self._known_triggers.items():
-            if self.match(self._current_view, trigger, trigger_key):
-                matched_pixels.add(TriggerColors[trigger_key])
+        # Triggers sharing a region are classified together in one pass over that view
+        return self._collect_triggers(
+            self._match_triggers(region, matcher) for region, matcher in color_matchers.items()
+        )
+
+    async def _detect_parallel(self) -> Union[Detection, Set[TriggerColors], None]:
+        images, color_matchers = self._detectors()
+        self._prepare_pyramids(images)
+        image_futures = [self._executor.submit(self._match_image, image_key, matcher)
+                         for image_key, matcher in images.items()]
+        trigger_futures = [self._executor.submit(self._match_triggers, region, matcher)
+                           for region, matcher in color_matchers.items()]
+        waiters = {future: asyncio.wrap_future(future) for future in image_futures + trigger_futures}
+
+        try:
+            # The first image found wins, as in the sequential path
+            pending = {waiters[future] for future in image_futures}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    detection = waiter.result()
+                    if detection is not None:
+                        self._last_detection = detection
+                        return detection
+
+            return self._collect_triggers(await asyncio.gather(*(waiters[future] for future in trigger_futures)))
+        finally:
+            # Detectors which have not started are cancelled and those already running are waited for, discarding
+            # what they find, as they share the pyramids the next look rebuilds.  Fresh waiters are used since the
+            # look's own may have been cancelled along with it
+            running = [asyncio.wrap_future(future) for future in waiters if not future.cancel()]
+            cancelled = False
+            while not all(waiter.done() for waiter in running):
+                try:
+                    await asyncio.wait(running)
+                except asyncio.CancelledError:
+                    # Cancelling the look is passed on once its detectors have stopped
+                    cancelled = True
+            for waiter in running + list(waiters.values()):
+                if waiter.done() and not waiter.cancelled():
+                    waiter.exception()
+            if cancelled:
+                raise asyncio.CancelledError
+
+    def _prepare_pyramids(self, images):
+        # Downscaled copies of each region's view are built once per look and shared between templates
+        for pyramid in self._pyramids.values():
+            pyramid.update(None)
+
+        for image_key in images:
+            region = self._image_regions.get(image_key)
+            pyramid = self._pyramids.setdefault(region, FramePyramid())
+            if pyramid.frame is None:
+                pyramid.update(self.region_view(self._current_view_bw, region))
+
+    def _match_image(self, image_key, matcher) -> Optional[Detection]:
+        region = self._image_regions.get(image_key)
+        with instruments.span(f'detector.{image_key}'):
+            score, location = self._track_image(image_key, matcher, self._pyramids[region])
+
+        if get_settings().captain.verbosity >= 3:
+            logger.debug('Template match for %s: %.3f at %s (%s)', image_key, score, location, matcher.timings)
 
-        return matched_pixels or None
+        if score < matcher.threshold:
+            return None
 
-    def match(self, image, color, color_name) -> bool:
-        lower, upper = (
-            array([color[0] - self._variance, color[1] - self._variance, color[2] - self._variance]),
-            array([color[0] + self._variance, color[1] + self._variance, color[2] + self._variance])
+        return Detection(
+            target=ImageRegistry[image_key],
+            score=score,
+            bbox=self._screen_bbox(region, location, matcher.template.shape)
         )
-        match = cv.inRange(image, lower, upper).any()
-        matched = (match >= 0.74).any()
 
-        if VERBOSITY >= 3:
-            logger.debug(f'Pixel match result for {color_name}: {matched}')
+    def _track_image(self, image_key, matcher, pyramid):
+        # The template is first looked for around where it was last seen, only searching the whole view when it is
+        # no longer there
+        window = None if self._tracker is None else self._tracker.window(image_key, pyramid.frame.shape)
+        if window is not None:
+            score, location = matcher.match_window(pyramid.frame, window)
+            if score >= matcher.threshold:
+                self._track_hit(image_key, self._template_bbox(location, matcher))
+                return score, location
+            self._track_miss(image_key)
 
-        return matched
+        score, location = matcher.match(pyramid)
+        if self._tracker is not None and score >= matcher.threshold:
+            self._tracker.update(image_key, self._template_bbox(location, matcher))
+        return score, location
 
-    def learn_image(self, image_key, image_path):
-        image = cv.imread(str(image_path))
+    @staticmethod
+    def _template_bbox(location, matcher):
+        height, width = matcher.template.shape[:2]
+        return location[0], location[1], location[0] + width, location[1] + height
 
-        if image is None or not image.any():
-            raise ValueError(f'Invalid image path (file does not exist): {image_path}')
+    def _match_triggers(self, region, matcher) -> dict:
+        # Trigger colors are not tracked: finding one where it was last seen says nothing about the others (the
+        # tension colors replace each other anywhere on the bar), so the whole view is always classified
+        with instruments.span('detector.triggers'):
+            return matcher.match(self.region_view(self._current_view, region))
 
-        self._known_images[image_key] = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    def _track_hit(self, key, bbox):
+        self._tracker.hit(key, bbox)
+        instruments.count('eyes.track_hit')
 
-        if VERBOSITY >= 3:
+    def _track_miss(self, key):
+        self._tracker.miss(key)
+        instruments.count('eyes.track_miss')
+
+    def _collect_triggers(self, results) -> Optional[Set[TriggerColors]]:
+        self._trigger_counts = {}
+        for counts in results:
+            self._trigger_counts.update(counts)
+
+        if get_settings().captain.verbosity >= 3:
+            logger.debug('Pixel match counts: %s', self._trigger_counts)
+
+        return {TriggerColors[trigger_key] for trigger_key in self._trigger_counts} or None
+
+    def region_view(self, frame, region):
+        """ Slice a view of a detector region (relative to the visual field) out of the sampled frame """
+        if region is None or self._view_origin is None:
+            return frame
+
+        x, y = self._view_origin
+        left, top, right, bottom = region
+        return frame[top - y:bottom - y, left - x:right - x]
+
+    def _screen_bbox(self, region, location, shape):
+        x, y = self._sampled_field[:2]
+        if region is not None and self._view_origin is not None:
+            x += region[0] - self._view_origin[0]
+            y += region[1] - self._view_origin[1]
+
+        height, width = shape[:2]
+        return x + location[0], y + location[1], x + location[0] + width, y + location[1] + height
+
+    def learn_image(self, image_key, image_path, region=None):
+        settings = get_settings().vision
+        levels = None
+        if self._template_cache is not None:
+            levels = self._template_cache.load(image_path, settings.template_scales)
+
+        if levels is None:
+            image = cv.imread(str(image_path))
+
+            if image is None or not image.any():
+                raise ValueError(f'Invalid image path (file does not exist): {image_path}')
+
+            template = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+        else:
+            template = levels[1.0]
+
+        if region is not None:
+            left, top, right, bottom = region
+            if bottom - top < template.shape[0] or right - left < template.shape[1]:
+                raise ValueError(f'Region {region} is smaller than the {image_key} image')
+
+        matcher = TemplateMatcher(
+            template,
+            scales=settings.template_scales,
+            threshold=settings.template_threshold,
+            coarse_threshold=settings.template_coarse_threshold,
+            levels=levels
+        )
+        if levels is None and self._template_cache is not None:
+            self._template_cache.store(image_path, settings.template_scales, matcher.levels)
+
+        self._known_images[image_key] = matcher
+        self._learn_region(self._image_regions, image_key, region)
+        self._forget_result()
+
+        if get_settings().captain.verbosity >= 3:
             logger.info(f'Learned image: {image_path}')
 
-    def learn_trigger(self, trigger_key, trigger_rgb):
+    def learn_trigger(self, trigger_key, trigger_rgb, region=None):
         self._known_triggers[trigger_key] = trigger_rgb
+        self._learn_region(self._trigger_regions, trigger_key, region)
 
-        if VERBOSITY >= 3:
+        # Bounds are computed once here and batched with the other triggers watching the same region
+        for matcher in self._color_matchers.values():
+            matcher.forget(trigger_key)
+
+        region = self._trigger_regions.get(trigger_key)
+        if region not in self._color_matchers:
+            self._color_matchers[region] = ColorMatcher(
+                variance=self._variance, min_pixels=get_settings().vision.trigger_min_pixels
+            )
+        self._color_matchers[region].learn(trigger_key, trigger_rgb)
+        self._color_matchers = {key: matcher for key, matcher in self._color_matchers.items() if len(matcher)}
+        self._focused_color_matchers = {}
+        self._forget_result()
+
+        if get_settings().captain.verbosity >= 3:
             logger.info(f'Learned pixel color trigger: {trigger_key}')
+
+    def _forget_result(self):
+        # A result computed before learning or focusing on something new must not be reused for unchanged frames
+        self._last_result = None
+        self._focused = None
+        if self._change_detector is not None:
+            self._change_detector.reset()
+
+    def _learn_region(self, regions, key, region):
+        if region is None:
+            regions.pop(key, None)
+        else:
+            regions[key] = tuple(region)
+
+        # Only narrow the capture when every detector is confined to a region
+        if len(self._image_regions) < len(self._known_images) or \
+                len(self._trigger_regions) < len(self._known_triggers):
+            self._capture_region = None
+        else:
+            bounds = list(self._image_regions.values()) + list(self._trigger_regions.values())
+            self._capture_region = (
+                min(bound[0] for bound in bounds),
+                min(bound[1] for bound in bounds),
+                max(bound[2] for bound in bounds),
+                max(bound[3] for bound in bounds)
+            )
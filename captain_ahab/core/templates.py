@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import numpy
+from cv2 import cv2 as cv
+from typing import Dict, Optional
+from ..utils.settings import get_settings
+from .matchers import TemplateMatcher
+
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the preprocessing below changes so stale entries are never read
+CACHE_VERSION = 1
+
+
+class TemplateCache:
+    """
+    On-disk cache of preprocessed template pyramids
+
+    Entries are named after a digest of the source image's bytes and everything that shapes the preprocessing
+    (grayscale conversion, scales, minimum template size, OpenCV version and CACHE_VERSION).  Each holds every pyramid
+    level packed into a single `.npy` file, with a small JSON manifest of where each level starts.  The levels are
+    loaded as read-only views of one memory map, so every process on the host shares the same pages.  The manifest is
+    renamed into place last, so a reader never sees a partial entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image_path, scales) -> Optional[str]:
+        """ The entry name for an image and the scales it is matched at, None if the image cannot be read """
+        try:
+            source = pathlib.Path(image_path).read_bytes()
+        except OSError:
+            return None
+
+        digest = hashlib.sha256(source)
+        parameters = (CACHE_VERSION, 'gray', tuple(sorted(scales)), TemplateMatcher.min_template_size, cv.__version__)
+        digest.update(repr(parameters).encode())
+        return digest.hexdigest()[:32]
+
+    def load(self, image_path, scales) -> Optional[Dict[float, numpy.ndarray]]:
+        """ The cached pyramid levels of an image, None on a miss (including a missing or corrupt entry) """
+        key = self.key(image_path, scales)
+        try:
+            manifest = json.loads((self.directory / f'{key}.json').read_text()) if key else None
+        except (OSError, ValueError):
+            manifest = None
+
+        if manifest is None:
+            self.misses += 1
+            return None
+
+        try:
+            packed = numpy.load(str(self.directory / f'{key}.npy'), mmap_mode='r')
+            levels = {
+                scale: packed[offset:offset + height * width].reshape(height, width)
+                for scale, height, width, offset in manifest['levels']
+            }
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            # Dropping the manifest lets store() rebuild the entry
+            logger.warning(f'Discarding the broken template cache entry {key} for {image_path}: {error}')
+            (self.directory / f'{key}.json').unlink(missing_ok=True)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.debug(f'Loaded {image_path} from the template cache ({key})')
+        return levels
+
+    def store(self, image_path, scales, levels):
+        key = self.key(image_path, scales)
+        if key is None or (self.directory / f'{key}.json').exists():
+            return
+
+        manifest, offset = [], 0
+        for scale, level in sorted(levels.items()):
+            manifest.append((scale, level.shape[0], level.shape[1], offset))
+            offset += level.size
+        packed = numpy.concatenate([level.ravel() for _, level in sorted(levels.items())])
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._write(f'{key}.npy', lambda stream: numpy.save(stream, packed))
+        self._write(f'{key}.json', lambda stream: stream.write(json.dumps({'levels': manifest}).encode()))
+
+        logger.debug(f'Stored {image_path} in the template cache ({key})')
+
+    def _write(self, name, write):
+        # Written under a unique name then renamed, so concurrent writers of the same entry never interleave
+        descriptor, staging = tempfile.mkstemp(prefix=f'.{name}-', dir=str(self.directory))
+        try:
+            with os.fdopen(descriptor, 'wb') as stream:
+                write(stream)
+            os.replace(staging, str(self.directory / name))
+        except BaseException:
+            os.unlink(staging)
+            raise
+
+
+def get_template_cache(directory=None):
+    """ Build a TemplateCache when a cache directory is configured, otherwise None """
+
+    directory = directory or get_settings().vision.template_cache
+    return TemplateCache(directory) if directory else None
+
+
+__all__ = ['TemplateCache', 'get_template_cache']
@@ -1,5 +1,16 @@
 import abc
+import asyncio
+import heapq
+import itertools
+import logging
 import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from ..utils.instruments import instruments
+from ..utils.settings import get_settings
+
+
+logger = logging.getLogger(__name__)
 
 
 class TimePiece(metaclass=abc.ABCMeta):
@@ -13,11 +24,11 @@ class TimePiece(metaclass=abc.ABCMeta):
 
 class GameClock(TimePiece):
     def __init__(self):
-        super().__init__(initial_value=time.time())
+        super().__init__(initial_value=time.monotonic())
         self.mark = None
 
     def tick(self):
-        self.current_time = time.time()
+        self.current_time = time.monotonic()
 
     @property
     def elapsed(self):
@@ -28,7 +39,7 @@ class GameClock(TimePiece):
         return (self.mark - self.start_time) if self.mark else 0
 
     def set_mark(self):
-        self.mark = time.time()
+        self.mark = time.monotonic()
 
     def clear_mark(self):
         self.mark = None
@@ -36,17 +47,240 @@ class GameClock(TimePiece):
 
 class StopWatch(TimePiece):
     def __init__(self, max_time=1):
-        super().__init__()
+        super().__init__(initial_value=time.monotonic())
         self.max_time = max_time
-        self.done = False
 
     def start(self):
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
 
     def tick(self):
-        self.current_time = time.time()
-        if (self.current_time - self.start_time) >= self.max_time:
-            self.done = True
+        self.current_time = time.monotonic()
+
+    @property
+    def done(self):
+        """ Checked against the clock when read, so the watch never needs to be ticked """
+        return time.monotonic() - self.start_time >= self.max_time
+
+
+@dataclass(order=True)
+class Timer:
+    deadline: float
+    # Breaks ties between equal deadlines so timers fire in the order they were scheduled
+    sequence: int
+    name: str = field(compare=False)
+    callback: Optional[Callable] = field(compare=False, default=None)
+    interval: Optional[float] = field(compare=False, default=None)
+    cancelled: bool = field(compare=False, default=False)
+
+    @property
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class TimerQueue:
+    """
+    Named timers kept in a heap ordered by their monotonic deadline
+
+    Scheduling and firing a timer cost O(log n), and checking for expired timers when none are due costs a single
+    comparison against the earliest deadline, however many timers are pending.  Cancelled timers are only marked and
+    are discarded as they reach the top of the heap.  A timer with an `interval` is rescheduled each time it fires.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._timers = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, name):
+        return name in self._timers
+
+    def __getitem__(self, name) -> Timer:
+        return self._timers[name]
+
+    @property
+    def next_deadline(self) -> Optional[float]:
+        self._discard_cancelled()
+        return self._heap[0].deadline if self._heap else None
+
+    def schedule(self, name, delay, callback=None, interval=None) -> Timer:
+        if name in self._timers:
+            raise ValueError(f'{name} already exists in timers list')
+
+        timer = Timer(time.monotonic() + delay, next(self._sequence), name, callback, interval)
+        self._push(timer)
+        return timer
+
+    def cancel(self, name) -> bool:
+        timer = self._timers.pop(name, None)
+        if timer is None:
+            return False
+
+        timer.cancelled = True
+        # Rebuild once cancelled timers outnumber live ones so the heap cannot grow without bound
+        if len(self._heap) > 2 * len(self._timers) + 16:
+            self._heap = [timer for timer in self._heap if not timer.cancelled]
+            heapq.heapify(self._heap)
+        return True
+
+    def fire(self, now=None) -> int:
+        """ Run the callbacks of every timer past its deadline, returning how many fired """
+        now = time.monotonic() if now is None else now
+        fired = 0
+
+        while self._heap and self._heap[0].deadline <= now:
+            timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                continue
+
+            del self._timers[timer.name]
+            if timer.interval:
+                # Intervals missed while the loop was busy are skipped rather than fired in a burst
+                deadline = timer.deadline + timer.interval
+                if deadline <= now:
+                    deadline = now + timer.interval
+                self._push(Timer(deadline, next(self._sequence), timer.name, timer.callback, timer.interval))
+
+            fired += 1
+            if timer.callback is not None:
+                try:
+                    timer.callback()
+                except Exception:
+                    logger.exception('Error in the %s timer callback', timer.name)
+
+        return fired
+
+    def _push(self, timer):
+        self._timers[timer.name] = timer
+        heapq.heappush(self._heap, timer)
+
+    def _discard_cancelled(self):
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+
+
+class PrecisionTimer:
+    """
+    Sleeps to `time.perf_counter()` deadlines, sleeping most of the way then spinning for the rest
+
+    `time.sleep` and the event loop wake late by the scheduler's granularity (a millisecond or so on Linux, up to
+    15.6 ms on older Windows), so the timer sleeps until `margin` seconds before the deadline and spins, yielding the
+    GIL, through the remainder.  The margin starts at the [input] `spin_threshold` and grows to cover the overshoot
+    seen when waking from a sleep, up to `max_spin`, decaying back once sleeps are punctual again.
+
+    Durations given a `label` are recorded as the error between the requested and actual duration, in the
+    `timing.<label>` histogram of the instruments, with `timing.early` counting waits that ended early.
+    """
+
+    # Fraction of the learned margin kept on each wake, so a single late wake stops costing spin time eventually
+    MARGIN_DECAY = 0.99
+
+    def __init__(self, spin_threshold=None, max_spin=None):
+        self._spin_threshold = spin_threshold
+        self._max_spin = max_spin
+        self.margin = 0.0
+
+    @property
+    def spin_threshold(self) -> float:
+        return get_settings().input.spin_threshold if self._spin_threshold is None else self._spin_threshold
+
+    @property
+    def max_spin(self) -> float:
+        return get_settings().input.max_spin if self._max_spin is None else self._max_spin
+
+    @staticmethod
+    def now() -> float:
+        return time.perf_counter()
+
+    def _learn(self, target, woke):
+        """ Widen the margin to the overshoot of a sleep meant to end at `target` """
+        self.margin = min(self.max_spin, max(self.spin_threshold, woke - target, self.margin * self.MARGIN_DECAY))
+
+    def _spin(self, deadline) -> float:
+        now = time.perf_counter()
+        while now < deadline:
+            time.sleep(0)
+            now = time.perf_counter()
+        return now
+
+    def sleep_until(self, deadline) -> float:
+        """ Block until the perf_counter `deadline`, returning the time it was reached """
+        target = deadline - max(self.margin, self.spin_threshold)
+        now = time.perf_counter()
+        if now < target:
+            time.sleep(target - now)
+            self._learn(target, time.perf_counter())
+        return self._spin(deadline)
+
+    async def sleep_until_async(self, deadline) -> float:
+        """ sleep_until() on the event loop; only the final spin, at most `max_spin` seconds, blocks the loop """
+        target = deadline - max(self.margin, self.spin_threshold)
+        now = time.perf_counter()
+        if now < target:
+            await asyncio.sleep(target - now)
+            self._learn(target, time.perf_counter())
+        return self._spin(deadline)
+
+    def sleep(self, duration, label=None) -> float:
+        """ Sleep for `duration` seconds, returning how long it actually took """
+        started = time.perf_counter()
+        actual = self.sleep_until(started + duration) - started
+        self.record(label, duration, actual)
+        return actual
+
+    async def sleep_async(self, duration, label=None) -> float:
+        started = time.perf_counter()
+        actual = await self.sleep_until_async(started + duration) - started
+        self.record(label, duration, actual)
+        return actual
+
+    def hold(self, press, release, duration, start=None, label=None) -> float:
+        """
+        Call `press` at the `start` deadline (now by default) and `release` `duration` seconds after it was pressed
+
+        The release deadline is taken from the moment `press` returned, so neither a late start nor the time spent
+        sending the press stretches the hold.  Returns how long the input was actually held.
+        """
+        if start is not None:
+            self.sleep_until(start)
+        press()
+        pressed = time.perf_counter()
+        try:
+            self.sleep_until(pressed + duration)
+        finally:
+            release()
+        actual = time.perf_counter() - pressed
+        self.record(label, duration, actual)
+        return actual
+
+    async def hold_async(self, press, release, duration, start=None, label=None) -> float:
+        """ hold() on the event loop; a cancelled hold still releases """
+        if start is not None:
+            await self.sleep_until_async(start)
+        press()
+        pressed = time.perf_counter()
+        try:
+            await self.sleep_until_async(pressed + duration)
+        finally:
+            release()
+        actual = time.perf_counter() - pressed
+        self.record(label, duration, actual)
+        return actual
+
+    @staticmethod
+    def record(label, requested, actual):
+        if label is None or not instruments.enabled:
+            return
+
+        if actual < requested:
+            instruments.count('timing.early')
+        instruments.record(f'timing.{label}', abs(actual - requested))
+
+
+# Shared by every action, so the margin it learns carries over between them
+precision_timer = PrecisionTimer()
 
 
-__all__ = ['GameClock', 'StopWatch']
+__all__ = ['GameClock', 'PrecisionTimer', 'StopWatch', 'Timer', 'TimerQueue', 'precision_timer']
@@ -1,7 +1,11 @@
 import abc
-from ..utils.constants import config, ImageRegistry, TriggerColors
+from ..utils.constants import ImageRegistry, TriggerColors
+from ..utils.settings import get_settings
 from .angler import Angler
 from .sight import Eyes
+from .capture import get_capture_source, get_frame_pool
+from .recorder import get_frame_recorder
+from .templates import get_template_cache
 from .mobility import Legs
 from .voice import Voice
 from .world import SpriteObject, ColorTrigger
@@ -20,13 +24,20 @@ class SightTrainer(CaptainTrainer):
     """ Trainer which provides an initialized set of Eyes with known sprites/triggers loaded """
 
     def train(self):
-        self.captain.eyes = Eyes(*self.captain.visual_field)
+        self.captain.eyes = self.teach(Eyes(*self.captain.visual_field, source=get_capture_source(),
+                                            pool=get_frame_pool(), template_cache=get_template_cache(),
+                                            recorder=get_frame_recorder()))
 
+    @staticmethod
+    def teach(eyes):
+        regions = get_settings().regions
         for image in ImageRegistry:
-            self.captain.eyes.learn_image(image.name, image.value)
+            eyes.learn_image(image.name, image.value, region=regions.get(image.name))
 
         for trigger in TriggerColors:
-            self.captain.eyes.learn_trigger(trigger.name, trigger.value)
+            eyes.learn_trigger(trigger.name, trigger.value, region=regions.get(trigger.name))
+
+        return eyes
 
 
 class MovementTrainer(CaptainTrainer):
@@ -47,7 +58,7 @@ class FishingTrainer(CaptainTrainer):
     """ Trainer which provides an instance of the Angler ability """
 
     def train(self):
-        self.captain.angler = Angler()
+        self.captain.angler = Angler(eyes=self.captain.eyes)
 
 
 __all__ = ['SightTrainer', 'MovementTrainer', 'VoiceTrainer', 'FishingTrainer']
@@ -1,63 +1,8 @@
-import logging
-import os
-import pathlib
 import enum
-import configparser
-from dotenv import load_dotenv, find_dotenv
-
-
-load_dotenv(find_dotenv())
-config = configparser.ConfigParser()
-config.read(os.environ.get('CAPTAIN_AHAB_CONFIG', 'pequod.ini'))
-fishing_config = config['fishing']
-
-TEST = bool(config['captain']['test'])
-VERBOSITY = int(config['captain']['verbosity'])
-SAMPLE_X = int(config['sample_dimensions']['x'])
-SAMPLE_Y = int(config['sample_dimensions']['y'])
-SAMPLE_WIDTH = int(config['sample_dimensions']['w'])
-SAMPLE_HEIGHT = int(config['sample_dimensions']['h'])
-SAMPLE_W = SAMPLE_X + SAMPLE_WIDTH
-SAMPLE_H = SAMPLE_Y + SAMPLE_HEIGHT
-LOG_LEVEL = getattr(logging, config['logging']['log_level'])
-CONSOLE_LOGGING = bool(config['logging']['console_logging'])
-
-if config['captain']['sample_image_path']:
-    SAMPLE_PATH = pathlib.Path(config['captain']['sample_image_path'])
-else:
-    SAMPLE_PATH = None
-
-if config['logging']['log_file']:
-    LOG_PATH = pathlib.Path(config['logging']['log_file'])
-else:
-    LOG_PATH = None
-
-
-# Log setup
-def get_handler(handler_cls, log_format='%(message)s', **kwargs):
-    formatter = logging.Formatter(fmt=log_format)
-    handler = handler_cls(**kwargs)
-    handler.setFormatter(formatter)
-    return handler
-
-
-handlers = []
-if CONSOLE_LOGGING:
-    handlers.append(get_handler(handler_cls=logging.StreamHandler))
-
-if LOG_PATH:
-    handlers.append(get_handler(
-        handler_cls=logging.FileHandler,
-        log_format='%(asctime)s:%(levelname)s:%(name)s(%(process)s): %(message)s',
-        filename=LOG_PATH,
-        mode='w'
-    ))
+import pathlib
 
-if handlers:
-    logging.basicConfig(level=LOG_LEVEL, force=True, handlers=handlers)
 
-logger = logging.getLogger(__name__)
-logger.info(f'Using log path: {LOG_PATH}')
+IMAGE_PATH = pathlib.Path(__file__).parent.parent / 'images'
 
 
 # Add to this enum to learn more keys
@@ -74,8 +19,8 @@ class InputCode(enum.Enum):
 # Add to this enum to learn new images
 class ImageRegistry(enum.Enum):
     # Fishing images
-    line_cast = pathlib.Path(os.path.abspath('./captain_ahab/images/line_cast.jpg'))
-    fish_hooked = pathlib.Path(os.path.abspath('./captain_ahab/images/fish_hooked.jpg'))
+    line_cast = IMAGE_PATH / 'line_cast.jpg'
+    fish_hooked = IMAGE_PATH / 'fish_hooked.jpg'
 
 
 # Add to this enum to learn more triggers
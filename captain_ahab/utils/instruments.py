@@ -0,0 +1,259 @@
+import asyncio
+import collections
+import functools
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from .settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """
+    Fixed-size log-linear histogram of durations, in the style of HdrHistogram
+
+    Durations are recorded in whole microseconds.  Values below 2**sub_bucket_bits are counted exactly; above that
+    every power of two is split into 2**(sub_bucket_bits - 1) buckets, so quantiles are accurate to within about 3%
+    with the default of 5 bits while the bucket array never grows.  Values above `max_seconds` are clamped.
+    """
+
+    def __init__(self, sub_bucket_bits=5, max_seconds=3600):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_value = int(max_seconds * 1e6)
+        self.counts = [0] * (self._index(self.max_value) + 1)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < 1 << self.sub_bucket_bits:
+            return value
+
+        shift = value.bit_length() - self.sub_bucket_bits
+        return (shift << (self.sub_bucket_bits - 1)) + (value >> shift)
+
+    def _value(self, index):
+        """ The highest value counted in the given bucket """
+        if index < 1 << self.sub_bucket_bits:
+            return index
+
+        shift = (index >> (self.sub_bucket_bits - 1)) - 1
+        mantissa = index - (shift << (self.sub_bucket_bits - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        with self._lock:
+            self.counts[self._index(value)] += 1
+            self.total += 1
+            self.sum += value
+            self.max = max(self.max, value)
+            self.min = value if self.min is None else min(self.min, value)
+
+    def quantile(self, quantile) -> float:
+        """ The duration, in seconds, below which the given fraction of recorded durations fall """
+        if not self.total:
+            return 0.0
+
+        rank = max(1, int(round(quantile * self.total)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index), self.max) / 1e6
+
+        return self.max / 1e6
+
+    def state(self) -> dict:
+        """ The raw bucket counts, compact enough to send to another process and merge there """
+        with self._lock:
+            return {
+                'sub_bucket_bits': self.sub_bucket_bits,
+                'counts': {index: count for index, count in enumerate(self.counts) if count},
+                'total': self.total,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max
+            }
+
+    def merge(self, state):
+        """ Add the counts from another histogram's state() """
+        if state['sub_bucket_bits'] != self.sub_bucket_bits:
+            raise ValueError('Cannot merge histograms with different bucket layouts')
+
+        with self._lock:
+            for index, count in state['counts'].items():
+                self.counts[index] += count
+            self.total += state['total']
+            self.sum += state['sum']
+            self.max = max(self.max, state['max'])
+            if state['min'] is not None:
+                self.min = state['min'] if self.min is None else min(self.min, state['min'])
+
+    def summary(self) -> dict:
+        return {
+            'count': self.total,
+            'mean': self.sum / self.total / 1e6 if self.total else 0.0,
+            'min': (self.min or 0) / 1e6,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max / 1e6
+        }
+
+
+class Span:
+    """ Times the body of a `with` block into a histogram """
+
+    __slots__ = ('_histogram', '_started')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.record(time.perf_counter() - self._started)
+        return False
+
+
+class NullSpan:
+    """ Stand-in returned while instrumentation is disabled, so a span costs a single method call """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Instruments:
+    """ Named latency histograms and counters for the hot paths, inert until enabled """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def histogram(self, name) -> LatencyHistogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self.histogram(name))
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def timed(self, name):
+        """ Decorate a function or coroutine function so each call is recorded as a span """
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def state(self) -> dict:
+        """ Raw histograms and counters, for merging into another Instruments with merge() """
+        return {
+            'started': self.started,
+            'histograms': {name: histogram.state() for name, histogram in list(self.histograms.items())},
+            'counters': dict(self.counters)
+        }
+
+    def merge(self, state):
+        """ Add another Instruments' state(), as when combining the reports of several processes """
+        for name, histogram in state['histograms'].items():
+            self.histogram(name).merge(histogram)
+        self.counters.update(state['counters'])
+        self.started = min(self.started, state['started'])
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = collections.Counter()
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'spans': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            'counters': dict(sorted(self.counters.items()))
+        }
+
+    def dump(self, path=None):
+        """ Log the current snapshot, also writing it as JSON to the given or configured dump path """
+        if not self.enabled:
+            return
+
+        path = path or get_settings().instrumentation.dump_path
+
+        snapshot = self.snapshot()
+        logger.info(f'Instrumentation:\n{format_snapshot(snapshot)}')
+
+        if path:
+            # Replaced in one step, so `captain-ahab metrics` never reads a partial dump
+            path = pathlib.Path(path)
+            staging = path.with_name(f'.{path.name}.tmp')
+            staging.write_text(json.dumps(snapshot, indent=2))
+            os.replace(staging, path)
+            logger.debug(f'Wrote instrumentation to {path}')
+
+
+def format_snapshot(snapshot) -> str:
+    lines = [f'{"span":<32}{"count":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}']
+    for name, summary in snapshot['spans'].items():
+        lines.append(
+            f'{name:<32}{summary["count"]:>9}' +
+            ''.join(f'{summary[key] * 1000:>10.2f}' for key in ('p50', 'p95', 'p99', 'max'))
+        )
+
+    for name, value in snapshot['counters'].items():
+        lines.append(f'{name:<32}{value:>9}')
+
+    return '\n'.join(lines)
+
+
+# Enabled by the entry point once the settings are loaded
+instruments = Instruments()
+
+
+__all__ = ['LatencyHistogram', 'Instruments', 'format_snapshot', 'instruments']
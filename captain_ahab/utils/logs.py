@@ -0,0 +1,101 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from .settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+TEXT_FORMAT = '%(asctime)s:%(levelname)s:%(name)s(%(process)s): %(message)s'
+LOG_FORMATS = ('text', 'json')
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats each record as one compact JSON object per line """
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread as they are
+
+    QueueHandler.prepare formats the message on the logging thread so records can be pickled to another process.
+    The listener here shares the process, so formatting is left to it entirely.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def get_handler(handler_cls, formatter, **kwargs):
+    handler = handler_cls(**kwargs)
+    handler.setFormatter(formatter)
+    return handler
+
+
+def configure_logging(settings=None, truncate=False):
+    """
+    Install the console and file handlers described by the [logging] settings
+
+    Nothing is configured at import time, so this must be called by entry points.  A run of the captain starts a
+    fresh log file (`truncate`); other commands append to it.  Loggers only put records on a queue; the handlers
+    format and write them on a listener thread, which is stopped (flushing what remains) at exit.
+    """
+    settings = (settings or get_settings()).logging
+    if settings.log_format not in LOG_FORMATS:
+        raise ValueError(f'Unknown log format: {settings.log_format}')
+
+    handlers = []
+    if settings.console_logging:
+        handlers.append(get_handler(logging.StreamHandler, logging.Formatter('%(message)s')))
+
+    if settings.log_file:
+        handlers.append(get_handler(
+            logging.FileHandler,
+            JsonFormatter() if settings.log_format == 'json' else logging.Formatter(TEXT_FORMAT),
+            filename=settings.log_file,
+            mode='w' if truncate else 'a'
+        ))
+
+    stop_logging()
+    if handlers:
+        global _listener
+
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        logging.basicConfig(level=settings.log_level, force=True, handlers=[LocalQueueHandler(records)])
+
+    logger.info('Using log path: %s', settings.log_file)
+
+
+def stop_logging():
+    """ Write out any queued records and stop the listener thread """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+__all__ = ['JsonFormatter', 'configure_logging', 'stop_logging']
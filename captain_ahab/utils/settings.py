@@ -0,0 +1,343 @@
+import configparser
+import logging
+import os
+import pathlib
+import threading
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = 'pequod.ini'
+
+# Configuration file names of the sections and options which differ from the fields of Settings
+SECTION_NAMES = {'sample': 'sample_dimensions'}
+OPTION_NAMES = {('sample', 'width'): 'w', ('sample', 'height'): 'h', ('recording', 'image_format'): 'format'}
+
+
+@dataclass(frozen=True)
+class CaptainSettings:
+    test: bool = True
+    verbosity: int = 2
+
+
+@dataclass(frozen=True)
+class SampleSettings:
+    x: int = 250
+    y: int = 250
+    width: int = 1300
+    height: int = 1300
+
+    @property
+    def right(self) -> int:
+        return self.x + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.y + self.height
+
+    @property
+    def field(self) -> Tuple[int, int, int, int]:
+        """ The sample rectangle as a (left, top, right, bottom) screen bbox """
+        return self.x, self.y, self.right, self.bottom
+
+
+@dataclass(frozen=True)
+class CaptureSettings:
+    source: str = 'imagegrab'
+    display: Optional[str] = None
+    buffer_count: int = 0
+    replay_path: Optional[str] = None
+    replay_fps: Optional[float] = None
+    replay_loop: bool = False
+
+
+@dataclass(frozen=True)
+class RecordingSettings:
+    mode: str = 'off'
+    every: int = 1
+    directory: pathlib.Path = pathlib.Path('samples')
+    ring_size: int = 100
+    image_format: str = 'jpg'
+    jpeg_quality: int = 80
+    png_compression: int = 1
+    queue_size: int = 4
+
+
+@dataclass(frozen=True)
+class InputSettings:
+    backend: str = 'win32'
+    spin_threshold: float = 0.002
+    max_spin: float = 0.02
+
+
+@dataclass(frozen=True)
+class VisionSettings:
+    trigger_min_pixels: int = 1
+    template_threshold: float = 0.75
+    template_coarse_threshold: Optional[float] = None
+    template_scales: Tuple[float, ...] = ()
+    template_cache: Optional[pathlib.Path] = None
+    change_threshold: float = 0.0
+    track_padding: int = 0
+    track_frames: int = 30
+    detector_workers: int = 0
+
+
+@dataclass(frozen=True)
+class PipelineSettings:
+    enabled: bool = False
+    queue_size: int = 1
+    drop_policy: str = 'drop_oldest'
+    capture_interval: float = 0.05
+    report_interval: float = 0.0
+
+
+@dataclass(frozen=True)
+class InstrumentationSettings:
+    enabled: bool = False
+    dump_path: Optional[pathlib.Path] = None
+
+
+@dataclass(frozen=True)
+class LoggingSettings:
+    log_level: int = logging.DEBUG
+    log_file: Optional[pathlib.Path] = None
+    log_format: str = 'text'
+    console_logging: bool = True
+
+
+@dataclass(frozen=True)
+class FleetSettings:
+    status_interval: float = 5.0
+    restart: bool = True
+    snapshot_dir: Optional[pathlib.Path] = None
+    # One captain process per entry: name = configuration file
+    captains: Dict[str, pathlib.Path] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class FishingSettings:
+    reel_delay_min: float = 1.1
+    reel_delay_max: float = 1.7
+    hook_delay_min: float = 0.1
+    hook_delay_max: float = 0.3
+    cast_delay_min: float = 0.9
+    cast_delay_max: float = 1.8
+    cast_timeout: float = 5.0
+    bite_timeout: float = 60.0
+    fight_timeout: float = 3.0
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Typed view of the configuration file
+
+    Missing options fall back to the defaults shipped in pequod.ini, so every field is always populated.  `path` is
+    the file the settings were read from, None when no configuration file was found.
+    """
+
+    path: Optional[pathlib.Path] = None
+    captain: CaptainSettings = field(default_factory=CaptainSettings)
+    sample: SampleSettings = field(default_factory=SampleSettings)
+    capture: CaptureSettings = field(default_factory=CaptureSettings)
+    recording: RecordingSettings = field(default_factory=RecordingSettings)
+    input: InputSettings = field(default_factory=InputSettings)
+    vision: VisionSettings = field(default_factory=VisionSettings)
+    pipeline: PipelineSettings = field(default_factory=PipelineSettings)
+    instrumentation: InstrumentationSettings = field(default_factory=InstrumentationSettings)
+    logging: LoggingSettings = field(default_factory=LoggingSettings)
+    fishing: FishingSettings = field(default_factory=FishingSettings)
+    fleet: FleetSettings = field(default_factory=FleetSettings)
+    # Detector regions of interest, relative to the sample field: name = left, top, right, bottom
+    regions: Dict[str, Tuple[int, int, int, int]] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path=None) -> 'Settings':
+        """ Parse the configuration file at `path`, $CAPTAIN_AHAB_CONFIG or ./pequod.ini, in that order """
+        path = pathlib.Path(path or os.environ.get('CAPTAIN_AHAB_CONFIG', DEFAULT_CONFIG_PATH))
+        config = configparser.ConfigParser()
+        if not config.read(path):
+            logger.warning(f'No configuration found at {path}, using the defaults')
+            return cls()
+
+        return cls(
+            path=path,
+            captain=CaptainSettings(
+                test=config.getboolean('captain', 'test', fallback=CaptainSettings.test),
+                verbosity=config.getint('captain', 'verbosity', fallback=CaptainSettings.verbosity)
+            ),
+            sample=SampleSettings(
+                x=config.getint('sample_dimensions', 'x', fallback=SampleSettings.x),
+                y=config.getint('sample_dimensions', 'y', fallback=SampleSettings.y),
+                width=config.getint('sample_dimensions', 'w', fallback=SampleSettings.width),
+                height=config.getint('sample_dimensions', 'h', fallback=SampleSettings.height)
+            ),
+            capture=CaptureSettings(
+                source=config.get('capture', 'source', fallback=CaptureSettings.source),
+                display=config.get('capture', 'display', fallback=None) or None,
+                buffer_count=config.getint('capture', 'buffer_count', fallback=CaptureSettings.buffer_count),
+                replay_path=config.get('capture', 'replay_path', fallback=None) or None,
+                replay_fps=config.getfloat('capture', 'replay_fps', fallback=None),
+                replay_loop=config.getboolean('capture', 'replay_loop', fallback=CaptureSettings.replay_loop)
+            ),
+            recording=RecordingSettings(
+                mode=config.get('recording', 'mode', fallback=RecordingSettings.mode),
+                every=config.getint('recording', 'every', fallback=RecordingSettings.every),
+                directory=_path(config.get('recording', 'directory', fallback=None)) or RecordingSettings.directory,
+                ring_size=config.getint('recording', 'ring_size', fallback=RecordingSettings.ring_size),
+                image_format=config.get('recording', 'format', fallback=RecordingSettings.image_format),
+                jpeg_quality=config.getint('recording', 'jpeg_quality', fallback=RecordingSettings.jpeg_quality),
+                png_compression=config.getint(
+                    'recording', 'png_compression', fallback=RecordingSettings.png_compression
+                ),
+                queue_size=config.getint('recording', 'queue_size', fallback=RecordingSettings.queue_size)
+            ),
+            input=InputSettings(
+                backend=config.get('input', 'backend', fallback=InputSettings.backend),
+                spin_threshold=config.getfloat('input', 'spin_threshold', fallback=InputSettings.spin_threshold),
+                max_spin=config.getfloat('input', 'max_spin', fallback=InputSettings.max_spin)
+            ),
+            vision=VisionSettings(
+                trigger_min_pixels=config.getint(
+                    'vision', 'trigger_min_pixels', fallback=VisionSettings.trigger_min_pixels
+                ),
+                template_threshold=config.getfloat(
+                    'vision', 'template_threshold', fallback=VisionSettings.template_threshold
+                ),
+                template_coarse_threshold=config.getfloat('vision', 'template_coarse_threshold', fallback=None),
+                template_scales=tuple(
+                    float(scale) for scale in config.get('vision', 'template_scales', fallback='').split(',')
+                    if scale.strip()
+                ),
+                template_cache=_path(config.get('vision', 'template_cache', fallback=None)),
+                change_threshold=config.getfloat(
+                    'vision', 'change_threshold', fallback=VisionSettings.change_threshold
+                ),
+                track_padding=config.getint('vision', 'track_padding', fallback=VisionSettings.track_padding),
+                track_frames=config.getint('vision', 'track_frames', fallback=VisionSettings.track_frames),
+                detector_workers=config.getint('vision', 'detector_workers', fallback=VisionSettings.detector_workers)
+            ),
+            pipeline=PipelineSettings(
+                enabled=config.getboolean('pipeline', 'enabled', fallback=PipelineSettings.enabled),
+                queue_size=config.getint('pipeline', 'queue_size', fallback=PipelineSettings.queue_size),
+                drop_policy=config.get('pipeline', 'drop_policy', fallback=PipelineSettings.drop_policy),
+                capture_interval=config.getfloat(
+                    'pipeline', 'capture_interval', fallback=PipelineSettings.capture_interval
+                ),
+                report_interval=config.getfloat(
+                    'pipeline', 'report_interval', fallback=PipelineSettings.report_interval
+                )
+            ),
+            instrumentation=InstrumentationSettings(
+                enabled=config.getboolean('instrumentation', 'enabled', fallback=InstrumentationSettings.enabled),
+                dump_path=_path(config.get('instrumentation', 'dump_path', fallback=None))
+            ),
+            logging=LoggingSettings(
+                log_level=getattr(logging, config.get('logging', 'log_level', fallback='DEBUG')),
+                log_file=_path(config.get('logging', 'log_file', fallback=None)),
+                log_format=config.get('logging', 'log_format', fallback=LoggingSettings.log_format),
+                console_logging=config.getboolean(
+                    'logging', 'console_logging', fallback=LoggingSettings.console_logging
+                )
+            ),
+            fishing=FishingSettings(**{
+                option.name: config.getfloat('fishing', option.name, fallback=option.default)
+                for option in fields(FishingSettings)
+            }),
+            fleet=FleetSettings(
+                status_interval=config.getfloat('fleet', 'status_interval', fallback=FleetSettings.status_interval),
+                restart=config.getboolean('fleet', 'restart', fallback=FleetSettings.restart),
+                snapshot_dir=_path(config.get('fleet', 'snapshot_dir', fallback=None)),
+                captains={
+                    name: pathlib.Path(value)
+                    for name, value in (config.items('captains') if config.has_section('captains') else ())
+                    if value
+                }
+            ),
+            regions={
+                name: tuple(int(bound) for bound in value.split(','))
+                for name, value in (config.items('regions') if config.has_section('regions') else ())
+                if value
+            }
+        )
+
+    def to_config(self) -> configparser.ConfigParser:
+        """ The settings as configuration file sections, named and spelled as `load` reads them, unset ones left out """
+        config = configparser.ConfigParser(interpolation=None)
+        for section in fields(self):
+            options = getattr(self, section.name)
+            if not is_dataclass(options):
+                continue
+
+            name = SECTION_NAMES.get(section.name, section.name)
+            config[name] = {
+                OPTION_NAMES.get((section.name, option.name), option.name): _spell(section.name, option.name, value)
+                for option, value in ((option, getattr(options, option.name)) for option in fields(options))
+                if value is not None and not isinstance(value, dict)
+            }
+
+        config['captains'] = {name: str(path) for name, path in self.fleet.captains.items()}
+        config['regions'] = {name: _spell('regions', name, region) for name, region in self.regions.items()}
+        return config
+
+
+def _spell(section, option, value) -> str:
+    if (section, option) == ('logging', 'log_level'):
+        return logging.getLevelName(value)
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, tuple):
+        return ', '.join(str(item) for item in value)
+    return str(value)
+
+
+def _path(value) -> Optional[pathlib.Path]:
+    return pathlib.Path(value) if value else None
+
+
+_settings = None
+_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    """ The settings, parsed from the configuration file on first use and cached until reloaded """
+    settings = _settings
+    if settings is None:
+        with _lock:
+            if _settings is None:
+                _load()
+            settings = _settings
+    return settings
+
+
+def reload_settings(path=None) -> Settings:
+    """ Re-read the configuration file, from `path` when given; components read the new values on next use """
+    with _lock:
+        _load(path)
+        return _settings
+
+
+def use_settings(settings: Settings) -> Settings:
+    """ Have components read `settings` in place of the configuration file's, until reloaded """
+    global _settings
+
+    with _lock:
+        _settings = settings
+        return _settings
+
+
+def _load(path=None):
+    global _settings
+
+    # Variables from a .env file may point CAPTAIN_AHAB_CONFIG elsewhere, so they are loaded first
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv(usecwd=True))
+
+    _settings = Settings.load(path)
+    logger.debug(f'Loaded settings from {_settings.path}')
+
+
+__all__ = ['Settings', 'get_settings', 'reload_settings', 'use_settings']